@@ -1,29 +1,89 @@
 # auth.py - Authentication utilities
 import os
+import time
+import asyncio
+import functools
+import threading
 import bcrypt
+from concurrent.futures import ThreadPoolExecutor
 import jwt
 from datetime import datetime, timedelta
+from cachetools import TLRUCache, TTLCache
 from fastapi import HTTPException, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from sqlalchemy.orm import Session
+from sqlalchemy import inspect as sa_inspect
+from sqlalchemy.orm import Session, make_transient_to_detached
 from models import User, get_db
 
+# Optional imports (graceful degradation)
+try:
+    from argon2 import PasswordHasher  # argon2id password hashing
+    from argon2.exceptions import VerificationError, InvalidHash
+except Exception:  # pragma: no cover
+    PasswordHasher = None
+
 # JWT Settings
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-change-this")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
 
+# Decoder configured once: key bytes, algorithm list and options are not rebuilt per request
+_JWT = jwt.PyJWT(options={"verify_signature": True, "verify_exp": True, "require": ["exp", "sub"]})
+_decode_token = functools.partial(_JWT.decode, key=SECRET_KEY.encode('utf-8'), algorithms=[ALGORITHM])
+
+# Password hashing settings
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASHER = os.getenv("PASSWORD_HASHER", "bcrypt").lower()  # "bcrypt" or "argon2"
+ARGON2_PREFIX = "$argon2"
+
+_argon2 = PasswordHasher(time_cost=2, memory_cost=19456, parallelism=1) if PasswordHasher else None
+
+# Dedicated pool for password KDFs (they release the GIL) so login bursts use every core
+# without competing with other run_in_executor work on the default pool
+_HASH_POOL = ThreadPoolExecutor(max_workers=max(2, os.cpu_count() or 1), thread_name_prefix="pwhash")
+
+# Auth cache settings
+AUTH_CACHE_TTL = int(os.getenv("AUTH_CACHE_TTL", "60"))  # seconds
+AUTH_CACHE_SIZE = 4096
+
 # Security
 security = HTTPBearer()
 
+def _auth_cache_ttu(token: str, entry: tuple, now: float) -> float:
+    """Expire cached entries after AUTH_CACHE_TTL or at token expiry, whichever is first"""
+    exp = entry[0]
+    return now + min(AUTH_CACHE_TTL, exp - time.time())
+
+# get_current_user runs on threadpool threads and cachetools caches are not
+# thread-safe, so every cache read and write goes through this lock
+_cache_lock = threading.Lock()
+# token -> (exp, user column snapshot); skips jwt.decode + user SELECT on repeat calls
+_auth_cache: TLRUCache = TLRUCache(maxsize=AUTH_CACHE_SIZE, ttu=_auth_cache_ttu)
+# user id -> user column snapshot; lets a fresh token (e.g. right after login) skip the SELECT
+_user_cache: TTLCache = TTLCache(maxsize=AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TTL)
+
 def hash_password(password: str) -> str:
-    """Hash a password using bcrypt"""
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    """Hash a password using bcrypt (or argon2id when PASSWORD_HASHER=argon2)"""
+    if PASSWORD_HASHER == "argon2" and _argon2 is not None:
+        return _argon2.hash(password)
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=BCRYPT_ROUNDS)).decode('utf-8')
 
 def verify_password(password: str, hashed_password: str) -> bool:
-    """Verify a password against its hash"""
+    """Verify a password against its hash; the hash prefix selects the algorithm"""
+    if hashed_password.startswith(ARGON2_PREFIX):
+        if _argon2 is None:
+            return False
+        try:
+            return _argon2.verify(hashed_password, password)
+        except (VerificationError, InvalidHash):
+            return False
     return bcrypt.checkpw(password.encode('utf-8'), hashed_password.encode('utf-8'))
 
+async def hash_password_async(password: str) -> str:
+    """hash_password on the password hashing pool, for use from async endpoints"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_HASH_POOL, hash_password, password)
+
 def create_access_token(data: dict) -> str:
     """Create a JWT access token"""
     to_encode = data.copy()
@@ -32,32 +92,73 @@ def create_access_token(data: dict) -> str:
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+# Never kept in the caches; merged users lazy-load it if something ever reads it
+_SNAPSHOT_EXCLUDE = {"hashed_password"}
+
+def _user_snapshot(user: User) -> dict:
+    return {
+        attr.key: getattr(user, attr.key)
+        for attr in sa_inspect(User).column_attrs
+        if attr.key not in _SNAPSHOT_EXCLUDE
+    }
+
+def remember_user(user: User) -> None:
+    """Prime the user cache, e.g. right after a login that will mint a new token"""
+    snapshot = _user_snapshot(user)
+    with _cache_lock:
+        _user_cache[user.id] = snapshot
+
+def _user_from_snapshot(snapshot: dict, db: Session) -> User:
+    """Attach a cached user to this request's session without a SELECT"""
+    user = User(**snapshot)
+    make_transient_to_detached(user)
+    return db.merge(user, load=False)
+
 def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security), 
     db: Session = Depends(get_db)
 ) -> User:
     """Get the current authenticated user from JWT token"""
-    try:
-        token = credentials.credentials
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: str = payload.get("sub")
-        if user_id is None:
+    token = credentials.credentials
+    with _cache_lock:
+        cached = _auth_cache.get(token)
+    if cached is not None:
+        user = _user_from_snapshot(cached[1], db)
+    else:
+        try:
+            payload = _decode_token(token)
+            user_id: str = payload["sub"]
+        except jwt.PyJWTError:
             raise HTTPException(status_code=401, detail="Invalid token")
-    except jwt.PyJWTError:
-        raise HTTPException(status_code=401, detail="Invalid token")
-    
-    user = db.query(User).filter(User.id == user_id).first()
-    if user is None:
-        raise HTTPException(status_code=401, detail="User not found")
+        
+        with _cache_lock:
+            snapshot = _user_cache.get(user_id)
+        if snapshot is not None:
+            user = _user_from_snapshot(snapshot, db)
+        else:
+            user = db.query(User).filter(User.id == user_id).first()
+            if user is None:
+                raise HTTPException(status_code=401, detail="User not found")
+            snapshot = _user_snapshot(user)
+            with _cache_lock:
+                _user_cache[user_id] = snapshot
+
+        with _cache_lock:
+            _auth_cache[token] = (payload["exp"], snapshot)
     
     if not user.is_active:
         raise HTTPException(status_code=401, detail="User account is disabled")
     
     return user
 
-def authenticate_user(email: str, password: str, db: Session) -> User:
+async def authenticate_user(email: str, password: str, db: Session) -> User:
     """Authenticate a user by email and password"""
     user = db.query(User).filter(User.email == email).first()
-    if not user or not verify_password(password, user.hashed_password):
+    if not user:
+        return None
+
+    # Password KDFs are deliberately slow; keep them off the event loop
+    loop = asyncio.get_running_loop()
+    if not await loop.run_in_executor(_HASH_POOL, verify_password, password, user.hashed_password):
         return None
     return user
\ No newline at end of file
@@ -1,86 +1,179 @@
 # chat.py - Fixed version
+import io
 import json
-from typing import Dict, List
+import asyncio
+import hashlib
+from typing import Dict, List, Optional
+import httpx
 import openai
+from openai import DefaultAioHttpClient  # needs openai[aiohttp]; not part of the API's requirements.txt
+from cachetools import TTLCache
+
+# Answer cache settings
+ANSWER_CACHE_SIZE = 2048
+ANSWER_CACHE_TTL = 600  # seconds
+
+# Short questions ("what is your pricing?") get a smaller answer budget and less context
+SHORT_QUESTION_CHARS = 40
+SHORT_MAX_TOKENS = 120
+DEFAULT_MAX_TOKENS = 500
+SHORT_MAX_RESULTS = 3
+
+# Kept byte-identical across calls so OpenAI's automatic prompt caching can reuse the prefix
+SYSTEM_PROMPT = """You are a helpful sales assistant for this company's website.
+Answer questions based ONLY on the provided context from the company's website or data.
+Focus on sales, pricing, and product features information.
+If the information is not in the context, clearly say you say that my current information is limited.
+Keep responses polite, concise and helpful.
+Always mention when you're referencing specific product or pricing information."""
+
+# Process-wide OpenAI client, built on first use (constructing it needs OPENAI_API_KEY)
+_OPENAI_CLIENT: Optional[openai.AsyncOpenAI] = None
+
+def get_openai_client() -> openai.AsyncOpenAI:
+    """Return the shared async OpenAI client on the aiohttp transport.
+
+    Every ChatManager reuses this one client so keep-alive connections and
+    TLS sessions survive across requests.
+    """
+    global _OPENAI_CLIENT
+    if _OPENAI_CLIENT is None:
+        _OPENAI_CLIENT = openai.AsyncOpenAI(
+            http_client=DefaultAioHttpClient(
+                limits=httpx.Limits(max_connections=100, max_keepalive_connections=50)
+            )
+        )
+    return _OPENAI_CLIENT
+
+async def close_openai_client():
+    """Close the shared OpenAI client"""
+    global _OPENAI_CLIENT
+    if _OPENAI_CLIENT is not None:
+        await _OPENAI_CLIENT.close()
+        _OPENAI_CLIENT = None
+
+def _format_source(result: Dict) -> Dict:
+    metadata = result['metadata']
+    return {
+        "url": metadata['source_url'],
+        "title": metadata['title'],
+        "relevance_score": round(result['score'], 3)
+    }
 
 class ChatManager:
-    def __init__(self, embedding_manager):  # Removed type hint to fix error
+    def __init__(self, embedding_manager, client: Optional[openai.AsyncOpenAI] = None):  # Removed type hint to fix error
         self.embedding_manager = embedding_manager
-        self.client = openai.OpenAI()
-    
+        self.client = client or get_openai_client()
+
+        # question hash -> Future[response dict]; in-flight entries are shared
+        # so concurrent identical questions trigger a single LLM call
+        self._answer_cache: TTLCache = TTLCache(maxsize=ANSWER_CACHE_SIZE, ttl=ANSWER_CACHE_TTL)
+
+    def _cache_key(self, question: str, max_results: int) -> str:
+        normalized = question.lower().strip()
+        return hashlib.sha256(f"{max_results}:{normalized}".encode('utf-8')).hexdigest()
+
     async def process_query(self, question: str, max_results: int = 5) -> Dict:
-        """Process user query and generate response"""
-        
+        """Process user query and generate response (cached by question hash)"""
+        key = self._cache_key(question, max_results)
+
+        pending = self._answer_cache.get(key)
+        if pending is not None:
+            try:
+                return await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                if not pending.cancelled():
+                    raise  # this request itself was cancelled
+                # The request computing this answer was cancelled; answer it here instead
+
+        future = asyncio.get_running_loop().create_future()
+        self._answer_cache[key] = future
+
+        try:
+            try:
+                result = await self._answer_query(question, max_results)
+            except Exception as e:
+                print(f"Error generating response: {e}")
+                # Never cache failures; release any waiters with the same error reply
+                self._drop_pending(key, future)
+                result = {
+                    "answer": "I encountered an error processing your question. Please try again.",
+                    "sources": [],
+                    "confidence": 0.0
+                }
+            future.set_result(result)
+            return result
+        finally:
+            if not future.done():
+                # Cancelled mid-flight (e.g. client disconnect): free the key and wake waiters
+                self._drop_pending(key, future)
+                future.cancel()
+
+    def _drop_pending(self, key: str, future: asyncio.Future):
+        """Remove an in-flight entry unless a newer request has replaced it"""
+        if self._answer_cache.get(key) is future:
+            del self._answer_cache[key]
+
+    async def _answer_query(self, question: str, max_results: int) -> Dict:
+        """Retrieve context and generate an answer with the LLM"""
+        is_short = len(question.strip()) < SHORT_QUESTION_CHARS
+        if is_short:
+            max_results = min(max_results, SHORT_MAX_RESULTS)
+
         # Retrieve relevant context
         context_results = await self.embedding_manager.search_similar(
-            question, 
+            question,
             max_results=max_results
         )
-        
+
         if not context_results:
             return {
                 "answer": "I don't have information about that topic in my knowledge base.",
                 "sources": [],
                 "confidence": 0.0
             }
-        
-        # Build context for LLM
-        context_text = "\n\n".join([
-            f"Source: {result['metadata']['source_url']}\n{result['text']}"
-            for result in context_results
-        ])
-        
+
+        # Build context for LLM in a single buffer
+        buf = io.StringIO()
+        for i, result in enumerate(context_results):
+            if i:
+                buf.write("\n\n")
+            buf.write("Source: ")
+            buf.write(result['metadata']['source_url'])
+            buf.write("\n")
+            buf.write(result['text'])
+        context_text = buf.getvalue()
+
         # Generate response using LLM
-        system_prompt = """You are a helpful sales assistant for this company's website. 
-        Answer questions based ONLY on the provided context from the company's website or data.
-        Focus on sales, pricing, and product features information.
-        If the information is not in the context, clearly say you say that my current information is limited.
-        Keep responses polite, concise and helpful.
-        Always mention when you're referencing specific product or pricing information."""
-        
         user_prompt = f"""Context from company website:
         {context_text}
-        
+
         Question: {question}
-        
+
         Please provide a helpful answer based on the context above."""
-        
-        try:
-            response = self.client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                temperature=0.1,
-                max_tokens=500
-            )
-            
-            answer = response.choices[0].message.content
-            
-            # Calculate confidence based on relevance scores
-            avg_confidence = sum(result['score'] for result in context_results) / len(context_results)
-            
-            # Format sources
-            sources = [
-                {
-                    "url": result['metadata']['source_url'],
-                    "title": result['metadata']['title'],
-                    "relevance_score": round(result['score'], 3)
-                }
-                for result in context_results
-            ]
-            
-            return {
-                "answer": answer,
-                "sources": sources,
-                "confidence": round(avg_confidence, 3)
-            }
-            
-        except Exception as e:
-            print(f"Error generating response: {e}")
-            return {
-                "answer": "I encountered an error processing your question. Please try again.",
-                "sources": [],
-                "confidence": 0.0
-            }
\ No newline at end of file
+
+        response = await self.client.chat.completions.create(
+            model="gpt-4o-mini",
+            messages=[
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": user_prompt}
+            ],
+            temperature=0.1,
+            max_tokens=SHORT_MAX_TOKENS if is_short else DEFAULT_MAX_TOKENS
+        )
+
+        answer = response.choices[0].message.content
+
+        # Confidence and sources in one pass over the results
+        total_score = 0.0
+        sources = [None] * len(context_results)
+        for i, result in enumerate(context_results):
+            total_score += result['score']
+            sources[i] = _format_source(result)
+        avg_confidence = total_score / len(context_results)
+
+        return {
+            "answer": answer,
+            "sources": sources,
+            "confidence": round(avg_confidence, 3)
+        }
@@ -1,13 +1,18 @@
 # google_oauth.py - Google OAuth implementation
 import os
+import uuid
+from typing import Optional
 import httpx
 import jwt
 from datetime import datetime, timezone
+from urllib.parse import urlencode
 from fastapi import HTTPException, Depends, Query
 from fastapi.responses import RedirectResponse
 from sqlalchemy.orm import Session
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from models import User, get_db
-from auth import create_access_token
+from auth import create_access_token, remember_user
 import logging
 
 logger = logging.getLogger(__name__)
@@ -23,6 +28,35 @@ GOOGLE_AUTH_URL = "https://accounts.google.com/o/oauth2/auth"
 GOOGLE_TOKEN_URL = "https://oauth2.googleapis.com/token"
 GOOGLE_USER_INFO_URL = "https://www.googleapis.com/oauth2/v2/userinfo"
 
+# Dialects that support INSERT ... ON CONFLICT ... RETURNING
+_UPSERT_INSERTS = {"postgresql": pg_insert, "sqlite": sqlite_insert}
+
+# Shared client: keep-alive + HTTP/2 to Google's endpoints across OAuth flows
+_HTTP: Optional[httpx.AsyncClient] = None
+
+def get_http_client() -> httpx.AsyncClient:
+    """Return the process-wide pooled client for Google OAuth calls"""
+    global _HTTP
+    if _HTTP is None:
+        # Pool settings live on the transport: httpx ignores client-level
+        # http2/limits once a custom transport is passed
+        _HTTP = httpx.AsyncClient(
+            timeout=10.0,
+            transport=httpx.AsyncHTTPTransport(
+                http2=True,
+                retries=1,
+                limits=httpx.Limits(max_connections=100, max_keepalive_connections=40, keepalive_expiry=30)
+            )
+        )
+    return _HTTP
+
+async def close_http_client():
+    """Close the shared client; call from the app's shutdown hook"""
+    global _HTTP
+    if _HTTP is not None:
+        await _HTTP.aclose()
+        _HTTP = None
+
 class GoogleOAuth:
     def __init__(self):
         if not GOOGLE_CLIENT_ID or not GOOGLE_CLIENT_SECRET:
@@ -42,30 +76,28 @@ class GoogleOAuth:
         if state:
             params["state"] = state
         
-        query_string = "&".join([f"{k}={v}" for k, v in params.items()])
-        return f"{GOOGLE_AUTH_URL}?{query_string}"
+        return f"{GOOGLE_AUTH_URL}?{urlencode(params)}"
     
     async def exchange_code_for_token(self, code: str) -> dict:
         """Exchange authorization code for access token"""
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    GOOGLE_TOKEN_URL,
-                    data={
-                        "client_id": GOOGLE_CLIENT_ID,
-                        "client_secret": GOOGLE_CLIENT_SECRET,
-                        "code": code,
-                        "grant_type": "authorization_code",
-                        "redirect_uri": GOOGLE_REDIRECT_URI,
-                    },
-                    headers={"Accept": "application/json"}
-                )
-                
-                if response.status_code != 200:
-                    logger.error(f"Token exchange failed: {response.text}")
-                    raise HTTPException(status_code=400, detail="Failed to exchange code for token")
-                
-                return response.json()
+            response = await get_http_client().post(
+                GOOGLE_TOKEN_URL,
+                data={
+                    "client_id": GOOGLE_CLIENT_ID,
+                    "client_secret": GOOGLE_CLIENT_SECRET,
+                    "code": code,
+                    "grant_type": "authorization_code",
+                    "redirect_uri": GOOGLE_REDIRECT_URI,
+                },
+                headers={"Accept": "application/json"}
+            )
+            
+            if response.status_code != 200:
+                logger.error(f"Token exchange failed: {response.text}")
+                raise HTTPException(status_code=400, detail="Failed to exchange code for token")
+            
+            return response.json()
                 
         except Exception as e:
             logger.error(f"Token exchange error: {e}")
@@ -74,22 +106,53 @@ class GoogleOAuth:
     async def get_user_info(self, access_token: str) -> dict:
         """Get user information from Google"""
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(
-                    GOOGLE_USER_INFO_URL,
-                    headers={"Authorization": f"Bearer {access_token}"}
-                )
-                
-                if response.status_code != 200:
-                    logger.error(f"User info request failed: {response.text}")
-                    raise HTTPException(status_code=400, detail="Failed to get user info")
-                
-                return response.json()
+            response = await get_http_client().get(
+                GOOGLE_USER_INFO_URL,
+                headers={"Authorization": f"Bearer {access_token}"}
+            )
+            
+            if response.status_code != 200:
+                logger.error(f"User info request failed: {response.text}")
+                raise HTTPException(status_code=400, detail="Failed to get user info")
+            
+            return response.json()
                 
         except Exception as e:
             logger.error(f"User info error: {e}")
             raise HTTPException(status_code=400, detail="Failed to get user information")
 
+def upsert_oauth_user(db: Session, email: str, name: str) -> User:
+    """Fetch or create the user for a Google login in a single round-trip
+
+    Uses INSERT ... ON CONFLICT(email) ... RETURNING where the dialect supports it.
+    Existing users keep their stored name. The returned user is detached so reading
+    its columns after the commit needs no refresh SELECT.
+    """
+    insert = _UPSERT_INSERTS.get(db.get_bind().dialect.name)
+    if insert is None:
+        user = db.query(User).filter(User.email == email).first()
+        if user is None:
+            user = User(email=email, full_name=name, hashed_password="oauth_user")  # Placeholder for OAuth users
+            db.add(user)
+            db.commit()
+            db.refresh(user)
+        return user
+
+    stmt = insert(User).values(
+        id=str(uuid.uuid4()),
+        email=email,
+        full_name=name,
+        hashed_password="oauth_user",  # Placeholder for OAuth users
+    )
+    # No-op update so RETURNING yields the existing row on conflict
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[User.email], set_={"email": stmt.excluded.email}
+    ).returning(User)
+    user = db.scalars(stmt, execution_options={"populate_existing": True}).one()
+    db.expunge(user)
+    db.commit()
+    return user
+
 # Global OAuth instance
 google_oauth = GoogleOAuth()
 
@@ -138,26 +201,10 @@ def get_google_oauth_endpoints():
             if not email:
                 raise HTTPException(status_code=400, detail="Email not provided by Google")
             
-            # Check if user exists
-            existing_user = db.query(User).filter(User.email == email).first()
-            
-            if existing_user:
-                # User exists, log them in
-                user = existing_user
-                logger.info(f"Existing user logged in via Google: {email}")
-            else:
-                # Create new user
-                user = User(
-                    email=email,
-                    full_name=name,
-                    hashed_password="oauth_user",  # Placeholder for OAuth users
-                )
-                
-                db.add(user)
-                db.commit()
-                db.refresh(user)
-                
-                logger.info(f"New user created via Google OAuth: {email}")
+            # Create the user on first login, otherwise fetch it (one round-trip)
+            user = upsert_oauth_user(db, email, name)
+            remember_user(user)
+            logger.info(f"User logged in via Google: {email}")
             
             # Create JWT token for our app
             jwt_token = create_access_token(data={"sub": str(user.id)})
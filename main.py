@@ -14,14 +14,14 @@ load_dotenv()
 
 from fastapi import FastAPI, HTTPException, BackgroundTasks, Depends, UploadFile, File, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import Response, RedirectResponse
+from fastapi.responses import Response, RedirectResponse, ORJSONResponse, StreamingResponse
 from typing import List, Dict
 import uvicorn
 import uuid
 
 # Import database models and utilities
 #from models import User, KnowledgeBase, ChatWidget, WidgetConversation, get_db, init_database
-from auth import get_current_user, hash_password, create_access_token, authenticate_user
+from auth import get_current_user, hash_password_async, create_access_token, authenticate_user, remember_user
 from schemas import (
     UserCreate, UserLogin, Token, 
     KnowledgeBaseCreate,
@@ -44,13 +44,15 @@ from subscription_middleware import (
 from razorpay_utils import razorpay_manager
 
 # Import the enhanced vector store and scraper
-from saas_embeddings import MemcacheS3VectorStore
+from saas_embeddings import MemcacheS3VectorStore, shutdown_embedding_executor
 from simple_scraper import EnhancedSimpleScraper as WebScraper
 
 # Import Google OAuth
-from google_oauth import GoogleOAuth, get_google_oauth_endpoints
+from google_oauth import GoogleOAuth, get_google_oauth_endpoints, upsert_oauth_user, close_http_client as close_oauth_client, GOOGLE_CLIENT_ID, FRONTEND_URL
 
 import httpx
+import orjson
+from cachetools import LRUCache
 
 def validate_environment():
     """Validate required environment variables"""
@@ -86,11 +88,18 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Settings read once at import instead of per request
+WIDGET_API_URL = os.getenv("WIDGET_API_URL", "http://localhost:8000")
+# Per-worker cap on live tenant stores; idle ones are dropped least-recently-used first
+# (data lives in Qdrant, so an evicted store is simply rebuilt on next access)
+VECTOR_STORE_CACHE_SIZE = int(os.getenv("VECTOR_STORE_CACHE_SIZE", "256"))
+
 # Validate environment and initialize database
 validate_environment()
 init_database()
 
-app = FastAPI(title="SaaS RAG Chatbot API", version="4.1.0")
+# orjson serializes response bodies in C (dicts/lists after FastAPI's jsonable_encoder)
+app = FastAPI(title="SaaS RAG Chatbot API", version="4.1.0", default_response_class=ORJSONResponse)
 
 # CORS middleware
 app.add_middleware(
@@ -104,7 +113,8 @@ app.add_middleware(
 # Enhanced Vector store manager with scraper integration
 class SaaSVectorManager:
     def __init__(self):
-        self.vector_stores = {}  # user_id -> knowledge_base_id -> vector_store
+        # (user_id, knowledge_base_id) -> vector_store
+        self.vector_stores: LRUCache = LRUCache(maxsize=VECTOR_STORE_CACHE_SIZE)
         # Initialize enhanced scraper with optimized settings
         self.scraper = WebScraper(
             max_retries=3,
@@ -120,25 +130,30 @@ class SaaSVectorManager:
         logger.info(f"📄 Scraped: {page.final_url} ({page.framework}, {page.to_dict()['word_count']} words) for {tenant_id}")
         
     def get_vector_store(self, user_id: str, knowledge_base_id: str) -> MemcacheS3VectorStore:
-        if user_id not in self.vector_stores:
-            self.vector_stores[user_id] = {}
-        
-        if knowledge_base_id not in self.vector_stores[user_id]:
-            self.vector_stores[user_id][knowledge_base_id] = MemcacheS3VectorStore(
+        key = (user_id, knowledge_base_id)
+        store = self.vector_stores.get(key)
+        if store is None:
+            store = MemcacheS3VectorStore(
                 user_id=user_id,
                 knowledge_base_id=knowledge_base_id
             )
+            self.vector_stores[key] = store
         
-        return self.vector_stores[user_id][knowledge_base_id]
+        return store
     
     def clear_vector_store(self, user_id: str, knowledge_base_id: str):
         """Clear a specific vector store"""
-        if user_id in self.vector_stores:
-            if knowledge_base_id in self.vector_stores[user_id]:
-                # Clear the vector store data
-                self.vector_stores[user_id][knowledge_base_id].clear_data()
-                # Remove from memory
-                del self.vector_stores[user_id][knowledge_base_id]
+        # Remove from memory
+        store = self.vector_stores.pop((user_id, knowledge_base_id), None)
+        if store is None:
+            # Not cached in this worker (evicted, or never opened here): the data still
+            # lives in Qdrant, so open a throwaway store just to delete it
+            store = MemcacheS3VectorStore(
+                user_id=user_id,
+                knowledge_base_id=knowledge_base_id
+            )
+        # Clear the vector store data
+        store.clear_data()
     
     async def scrape_websites(self, jobs: List[Dict]) -> Dict[str, List[Dict]]:
         """
@@ -151,6 +166,40 @@ class SaaSVectorManager:
 # Initialize vector manager
 vector_manager = SaaSVectorManager()
 
+@app.on_event("startup")
+async def startup_http_client():
+    """Create the process-wide pooled HTTP client (app.state.http)"""
+    app.state.http = httpx.AsyncClient(
+        timeout=30.0,
+        follow_redirects=True,
+        # retries=1 re-dials on connect errors instead of failing the page
+        transport=httpx.AsyncHTTPTransport(
+            http2=True,
+            retries=1,
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=40, keepalive_expiry=30),
+        ),
+    )
+
+@app.on_event("shutdown")
+async def shutdown_http_client():
+    """Close the process-wide pooled HTTP client"""
+    await app.state.http.aclose()
+
+@app.on_event("shutdown")
+async def shutdown_scraper():
+    """Close the shared Playwright browser"""
+    await vector_manager.scraper.close()
+
+@app.on_event("shutdown")
+async def shutdown_embeddings():
+    """Stop the shared embedding thread pool"""
+    shutdown_embedding_executor()
+
+@app.on_event("shutdown")
+async def shutdown_oauth_client():
+    """Close the pooled Google OAuth HTTP client"""
+    await close_oauth_client()
+
 # Google OAuth setup
 google_oauth = GoogleOAuth()
 oauth_endpoints = get_google_oauth_endpoints()
@@ -172,7 +221,7 @@ async def register(user_data: UserCreate, db: Session = Depends(get_db)):
         raise HTTPException(status_code=400, detail="Email already registered")
     
     # Create new user
-    hashed_password = hash_password(user_data.password)
+    hashed_password = await hash_password_async(user_data.password)
     db_user = User(
         email=user_data.email,
         hashed_password=hashed_password,
@@ -191,7 +240,7 @@ async def register(user_data: UserCreate, db: Session = Depends(get_db)):
 
 @app.post("/auth/login", response_model=Token)
 async def login(user_data: UserLogin, db: Session = Depends(get_db)):
-    user = authenticate_user(user_data.email, user_data.password, db)
+    user = await authenticate_user(user_data.email, user_data.password, db)
     
     if not user:
         raise HTTPException(status_code=401, detail="Incorrect email or password")
@@ -199,6 +248,7 @@ async def login(user_data: UserLogin, db: Session = Depends(get_db)):
     if not user.is_active:
         raise HTTPException(status_code=401, detail="User account is disabled")
     
+    remember_user(user)
     access_token = create_access_token(data={"sub": str(user.id)})
     
     logger.info(f"User logged in: {user_data.email}")
@@ -209,7 +259,7 @@ async def login(user_data: UserLogin, db: Session = Depends(get_db)):
 @app.get("/auth/google")
 async def google_auth():
     """Initiate Google OAuth flow"""
-    if not os.getenv("GOOGLE_CLIENT_ID"):
+    if not GOOGLE_CLIENT_ID:
         raise HTTPException(status_code=501, detail="Google OAuth not configured. Please set GOOGLE_CLIENT_ID and GOOGLE_CLIENT_SECRET environment variables.")
     
     auth_url = google_oauth.get_auth_url()
@@ -226,8 +276,7 @@ async def google_callback(
     
     if error:
         logger.error(f"Google OAuth error: {error}")
-        frontend_url = os.getenv("FRONTEND_URL", "http://localhost:3000")
-        return RedirectResponse(url=f"{frontend_url}?error=oauth_error")
+        return RedirectResponse(url=f"{FRONTEND_URL}?error=oauth_error")
     
     if not code:
         raise HTTPException(status_code=400, detail="Authorization code not provided")
@@ -249,41 +298,24 @@ async def google_callback(
         if not email:
             raise HTTPException(status_code=400, detail="Email not provided by Google")
         
-        # Check if user exists
-        existing_user = db.query(User).filter(User.email == email).first()
-        
-        if existing_user:
-            user = existing_user
-            logger.info(f"Existing user logged in via Google: {email}")
-        else:
-            # Create new user
-            user = User(
-                email=email,
-                full_name=name,
-                hashed_password="oauth_user",
-            )
-            
-            db.add(user)
-            db.commit()
-            db.refresh(user)
-            
-            logger.info(f"New user created via Google OAuth: {email}")
+        # Create the user on first login, otherwise fetch it (one round-trip)
+        user = upsert_oauth_user(db, email, name)
+        remember_user(user)
+        logger.info(f"User logged in via Google: {email}")
         
         # Create JWT token
         jwt_token = create_access_token(data={"sub": str(user.id)})
         
         # Redirect to frontend with token
-        frontend_url = os.getenv("FRONTEND_URL", "http://localhost:3000")
         return RedirectResponse(
-            url=f"{frontend_url}?token={jwt_token}&email={email}&name={name}"
+            url=f"{FRONTEND_URL}?token={jwt_token}&email={email}&name={name}"
         )
         
     except HTTPException:
         raise
     except Exception as e:
         logger.error(f"Google OAuth callback error: {e}")
-        frontend_url = os.getenv("FRONTEND_URL", "http://localhost:3000")
-        return RedirectResponse(url=f"{frontend_url}?error=oauth_failed")
+        return RedirectResponse(url=f"{FRONTEND_URL}?error=oauth_failed")
 
 @app.get("/auth/me")
 async def get_current_user_info(current_user: User = Depends(get_current_user)):
@@ -807,8 +839,8 @@ async def process_website_background_with_limits(user_id: str, knowledge_base_id
             # Try fallback simple scraping approach
             logger.info(f"🔄 Trying fallback scraping approach...")
             try:
-                import requests
-                from bs4 import BeautifulSoup
+                import lxml.html
+                import lxml.etree
                 
                 # Simple fallback scraping
                 headers = {
@@ -816,30 +848,29 @@ async def process_website_background_with_limits(user_id: str, knowledge_base_id
                 }
                 
                 fallback_pages = []
+                # App-wide pooled client: keep-alive across URLs and across scrape jobs
+                client: httpx.AsyncClient = app.state.http
                 for url in urls[:config.max_pages]:  # Respect max_pages limit
                     try:
-                        response = requests.get(url, headers=headers, timeout=10)
+                        response = await client.get(url, headers=headers, timeout=10)
                         if response.status_code == 200:
-                            soup = BeautifulSoup(response.content, 'html.parser')
-                            
+                            tree = lxml.html.fromstring(response.content)
+                        
                             # Extract title
-                            title = ""
-                            if soup.title:
-                                title = soup.title.string.strip() if soup.title.string else ""
-                            
+                            title = (tree.findtext('.//title') or "").strip()
+                        
                             # Extract text content
-                            # Remove script and style elements
-                            for script in soup(["script", "style"]):
-                                script.decompose()
-                            
+                            # Remove script and style elements (single C-level walk)
+                            lxml.etree.strip_elements(tree, 'script', 'style', with_tail=False)
+                        
                             # Get text
-                            text = soup.get_text()
-                            
+                            text = tree.text_content()
+                        
                             # Clean up text
                             lines = (line.strip() for line in text.splitlines())
                             chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
                             text = ' '.join(chunk for chunk in chunks if chunk)
-                            
+                        
                             if len(text.strip()) > 100:  # Only add if meaningful content
                                 page_data = {
                                     "final_url": url,
@@ -852,7 +883,7 @@ async def process_website_background_with_limits(user_id: str, knowledge_base_id
                                 }
                                 fallback_pages.append(page_data)
                                 logger.info(f"✅ Fallback scraped: {url} ({len(text)} chars)")
-                    
+                
                     except Exception as e:
                         logger.error(f"❌ Fallback scraping failed for {url}: {e}")
                         continue
@@ -1068,6 +1099,44 @@ async def query_knowledge_base(
         logger.error(f"Error processing query: {e}")
         raise HTTPException(status_code=500, detail="Error processing query")
 
+@app.post("/chat/query/stream")
+async def stream_knowledge_base_query(
+    query: QueryRequest,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Server-sent events: answer tokens as they arrive, then sources and confidence"""
+    knowledge_base = db.query(KnowledgeBase).filter(
+        KnowledgeBase.id == query.knowledge_base_id,
+        KnowledgeBase.user_id == current_user.id
+    ).first()
+    
+    if not knowledge_base:
+        raise HTTPException(status_code=404, detail="Knowledge base not found")
+    
+    if knowledge_base.status != "ready":
+        raise HTTPException(status_code=400, detail="Knowledge base is not ready")
+    
+    vector_store = vector_manager.get_vector_store(str(current_user.id), query.knowledge_base_id)
+    
+    if not vector_store.is_ready():
+        raise HTTPException(status_code=400, detail="Vector store not ready")
+    
+    async def events():
+        try:
+            async for event in vector_store.stream_query(query.question, query.max_results):
+                yield b"data: " + orjson.dumps(event, default=str) + b"\n\n"
+        except Exception as e:
+            logger.error(f"Error streaming query: {e}")
+            yield b'data: {"type":"error","detail":"Error processing query"}\n\n'
+    
+    logger.info(f"Streaming query for user {current_user.email}, KB {knowledge_base.name}")
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.get("/knowledge-bases/{knowledge_base_id}/status")
 async def get_knowledge_base_status(
     knowledge_base_id: str,
@@ -1328,7 +1397,7 @@ async def get_widget_script(widget_key: str, db: Session = Depends(get_db)):
 (function() {{
     var WIDGET_CONFIG = {{
         widgetKey: '{widget.widget_key}',
-        apiUrl: '{os.getenv("WIDGET_API_URL", "http://localhost:8000")}',
+        apiUrl: '{WIDGET_API_URL}',
         primaryColor: '{widget.primary_color}',
         position: '{widget.widget_position}',
         welcomeMessage: '{widget.welcome_message}',
@@ -1523,16 +1592,19 @@ def extract_text_from_file(file_path: str, filename: str) -> str:
                 text_content = []
                 
                 # Extract text from paragraphs
+                # .text re-joins the runs on every access; read it once per element
                 for paragraph in doc.paragraphs:
-                    if paragraph.text.strip():
-                        text_content.append(paragraph.text.strip())
+                    text = paragraph.text.strip()
+                    if text:
+                        text_content.append(text)
                 
                 # Extract text from tables
                 for table in doc.tables:
                     for row in table.rows:
                         for cell in row.cells:
-                            if cell.text.strip():
-                                text_content.append(cell.text.strip())
+                            text = cell.text.strip()
+                            if text:
+                                text_content.append(text)
                 
                 return '\n\n'.join(text_content)
                 
@@ -1587,4 +1659,17 @@ async def serve_static(file_path: str):
         raise HTTPException(status_code=404, detail="File not found")
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    # Workers need an import string; uvloop + httptools come with uvicorn[standard]
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        workers=int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1)),
+        loop="uvloop",
+        http="httptools",
+        limit_concurrency=1000,
+        timeout_keep_alive=30,
+        # Per-request access lines serialize on the logging lock; app logs still flow
+        log_level=os.getenv("UVICORN_LOG_LEVEL", "warning"),
+        access_log=False,
+    )
\ No newline at end of file
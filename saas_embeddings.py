@@ -3,12 +3,13 @@ from __future__ import annotations
 
 import os
 import time
-import uuid
 import math
 import hashlib
 import logging
 from datetime import datetime, timezone
-from typing import List, Dict, Optional
+import numpy as np
+from collections import defaultdict
+from typing import AsyncIterator, List, Dict, Optional, Tuple
 
 # Google Embedding + Gemini API
 import google.generativeai as genai
@@ -16,11 +17,18 @@ import google.generativeai as genai
 # Qdrant
 from qdrant_client import QdrantClient
 from qdrant_client.http import models
-from qdrant_client.http.models import Distance, VectorParams, PointStruct, Filter, FieldCondition, MatchValue
+from qdrant_client.http.models import Distance, VectorParams, Filter, FieldCondition, MatchValue, MatchAny
 
 # Async helpers
 import asyncio
 from concurrent.futures import ThreadPoolExecutor
+from cachetools import LRUCache, TTLCache
+
+# Optional imports (graceful degradation)
+try:
+    import blake3  # SIMD-accelerated hashing for change detection
+except Exception:  # pragma: no cover
+    blake3 = None
 
 logger = logging.getLogger(__name__)
 
@@ -28,9 +36,187 @@ logger = logging.getLogger(__name__)
 # Utility helpers
 # -----------------------------
 
-_DEF_MAX_WORKERS = int(os.getenv("EMBED_MAX_WORKERS", "8"))
-_DEF_BATCH_SIZE = int(os.getenv("EMBED_BATCH", "32"))
+_DEF_MAX_WORKERS = int(os.getenv("EMBED_WORKERS", os.getenv("EMBED_MAX_WORKERS", "16")))
+_DEF_EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "8"))  # in-flight embed requests per process
+_DEF_PAGE_CONCURRENCY = int(os.getenv("PAGE_CONCURRENCY", "8"))  # pages processed concurrently per batch
+_DEF_BATCH_SIZE = int(os.getenv("EMBED_BATCH", "96"))  # texts per embed_content request (API max 100)
 _DEF_SEARCH_LIMIT = 5
+_EMB_CACHE_SIZE = int(os.getenv("EMB_CACHE_SIZE", "20000"))  # cached chunk embeddings per process
+_QUERY_BATCH_WINDOW_MS = int(os.getenv("QUERY_BATCH_WINDOW_MS", "10"))  # query embedding coalescing window
+_QUERY_BATCH_MAX = int(os.getenv("QUERY_BATCH_MAX", "32"))
+_QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "4096"))  # cached query embeddings per process
+_ANSWER_MODEL = os.getenv("GEMINI_ANSWER_MODEL", "gemini-2.0-flash")
+_ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "256"))  # answered questions kept per store
+_ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", "300"))  # seconds; bounds staleness across workers
+_ANSWER_FALLBACK = "I'll get back to you with that information."
+
+# Static prompt pieces; only the context and question are spliced in per query
+_PROMPT_HEAD = (
+    "You are a helpful sales assistant. Based on the following information, "
+    "concisely answer the customer's question and focus on how our features can help them.\n\n"
+    "Information:\n"
+)
+_PROMPT_QUESTION = "\n\nCustomer Question: "
+_PROMPT_TAIL = (
+    "\n\n"
+    "Answer as a knowledgeable sales assistant. If you don't have the specific information needed, say you'll get back to them."
+)
+
+# Payload fields needed for change detection (skip transferring chunk text)
+_CHANGE_FIELDS = ["source_id", "chunk_index", "chunk_hash", "hash_alg", "source_len", "source_hash"]
+_SCROLL_PAGE_SIZE = 4096
+_SOURCES_PER_SCROLL = 512  # source ids per MatchAny filter
+_UPSERT_BATCH = 512  # points per upsert request
+_FLUSH_POINTS = int(os.getenv("QDRANT_FLUSH_POINTS", "4096"))  # buffered points that trigger a mid-batch upload
+# Upload worker processes for large flushes; 1 (in-process) inside the API server.
+# Raise only for offline bulk loads: each flush would otherwise spawn a process pool
+_UPLOAD_PARALLEL = int(os.getenv("QDRANT_UPLOAD_PARALLEL", "1"))
+
+# int8 scalar quantization: quantized vectors stay in RAM, originals live on disk for rescoring
+_QUANTIZATION = models.ScalarQuantization(
+    scalar=models.ScalarQuantizationConfig(type=models.ScalarType.INT8, quantile=0.99, always_ram=True)
+)
+_SEARCH_PARAMS = models.SearchParams(
+    quantization=models.QuantizationSearchParams(rescore=True, oversampling=2.0)
+)
+
+# Payload fields used in filters; keyword-indexed so filtered scroll/count/delete/search avoid full scans
+_FILTER_FIELDS = ("tenant_id", "kb_id", "source_id")
+_INDEXED_COLLECTIONS: set = set()  # collections whose payload indexes were ensured by this process
+_KNOWN_COLLECTIONS: set = set()  # collections this process has seen exist (collections are never dropped)
+_MODEL_DIMS: Dict[str, int] = {}  # embedding model -> vector size, probed once per process
+_READY_PROBE_TTL = float(os.getenv("IS_READY_TTL", "10"))  # seconds between count probes of a not-ready KB
+
+# Change-detection hash ("blake3" or "sha256"); stored with each chunk as hash_alg
+HASH_ALG = os.getenv("HASH_ALG", "blake3").lower()
+if HASH_ALG == "blake3" and blake3 is None:
+    HASH_ALG = "sha256"
+
+# One long-lived pool + request cap shared by every store instance (one store per tenant KB)
+_EMBED_EXECUTOR = ThreadPoolExecutor(max_workers=_DEF_MAX_WORKERS, thread_name_prefix="embed")
+_EMBED_SEM = asyncio.Semaphore(_DEF_EMBED_CONCURRENCY)
+
+# "model:content hash" -> float32 vector; boilerplate chunks (nav, footer) repeat across pages and KBs
+_EMB_CACHE: LRUCache = LRUCache(maxsize=_EMB_CACHE_SIZE)
+
+def shutdown_embedding_executor() -> None:
+    """Stop the shared embedding threads; call from the app's shutdown hook"""
+    _EMBED_EXECUTOR.shutdown(wait=False)
+
+async def _run_embed(fn, *args):
+    """Run a blocking embedding call on the shared pool, bounded by EMBED_CONCURRENCY"""
+    async with _EMBED_SEM:
+        return await asyncio.get_running_loop().run_in_executor(_EMBED_EXECUTOR, fn, *args)
+
+def _embed_queries(model_name: str, queries: List[str]) -> List[Optional[List[float]]]:
+    """Embed search queries in one embed_content request (blocking)"""
+    try:
+        # Same task type the baseline used for queries; scores (and reported confidence) depend on it
+        r = genai.embed_content(model=model_name, content=queries, task_type="retrieval_document")
+        embs = r["embedding"] if isinstance(r, dict) else getattr(r, "embedding", None)
+        if embs and len(embs) == len(queries):
+            return embs
+        logger.error("Query embedding returned %d vectors for %d queries", len(embs or []), len(queries))
+    except Exception as e:
+        logger.error("Query embedding error: %s", e)
+    return [None] * len(queries)
+
+class _QueryEmbedBatcher:
+    """Coalesce concurrent search queries arriving within a short window into one embedding request"""
+
+    def __init__(self, window_ms: int = _QUERY_BATCH_WINDOW_MS, max_batch: int = _QUERY_BATCH_MAX):
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._dispatches: set = set()  # strong refs so in-flight dispatch tasks aren't collected
+
+    async def embed(self, model_name: str, query: str) -> Optional[List[float]]:
+        """Queue a query and wait for its vector"""
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._collect())
+
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((model_name, query, future))
+        return await future
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.window
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            # Dispatch without waiting so the next window keeps filling
+            task = asyncio.create_task(self._dispatch(batch))
+            self._dispatches.add(task)
+            task.add_done_callback(self._dispatches.discard)
+
+    async def _dispatch(self, batch: List):
+        by_model: Dict[str, List] = defaultdict(list)
+        for item in batch:
+            by_model[item[0]].append(item)
+        for model_name, items in by_model.items():
+            try:
+                vectors = await _run_embed(_embed_queries, model_name, [query for _, query, _ in items])
+            except Exception as e:
+                vectors = [None] * len(items)
+                logger.error("Query embedding error: %s", e)
+            for (_, _, future), vec in zip(items, vectors):
+                if not future.done():
+                    future.set_result(vec)
+
+_QUERY_BATCHER = _QueryEmbedBatcher()
+
+# (model, query text) -> query vector; shared by every store, since the vector depends only on the text
+_QUERY_VEC_CACHE: LRUCache = LRUCache(maxsize=_QUERY_CACHE_SIZE)
+
+class _PointBuffer:
+    """Column buffers (ids / vectors / payloads) for points awaiting upload
+
+    Vectors are written straight into a float32 matrix that grows by doubling,
+    so the upload needs no per-point list -> array conversion.
+    """
+
+    __slots__ = ("ids", "payloads", "_vectors")
+
+    def __init__(self):
+        self.ids: List[str] = []
+        self.payloads: List[Dict] = []
+        self._vectors: Optional[np.ndarray] = None  # allocated on the first add, once dim is known
+
+    def add(self, point_id: str, vector, payload: Dict) -> None:
+        n = len(self.ids)
+        if self._vectors is None:
+            self._vectors = np.empty((256, len(vector)), dtype=np.float32)
+        elif n == len(self._vectors):
+            grown = np.empty((2 * n, self._vectors.shape[1]), dtype=np.float32)
+            grown[:n] = self._vectors
+            self._vectors = grown
+        self._vectors[n] = vector
+        self.ids.append(point_id)
+        self.payloads.append(payload)
+
+    def extend(self, other: "_PointBuffer") -> None:
+        for point_id, vector, payload in zip(other.ids, other.vectors, other.payloads):
+            self.add(point_id, vector, payload)
+
+    @property
+    def vectors(self) -> np.ndarray:
+        """The filled rows of the vector matrix"""
+        if self._vectors is None:
+            return np.empty((0, 0), dtype=np.float32)
+        return self._vectors[:len(self.ids)]
+
+    def __len__(self) -> int:
+        return len(self.ids)
 
 def _now_iso() -> str:
     return datetime.now(timezone.utc).isoformat()
@@ -39,25 +225,34 @@ def _env(name: str, default: Optional[str] = None) -> Optional[str]:
     v = os.getenv(name)
     return v if v is not None else default
 
-def content_hash(text: str) -> str:
-    """Generate SHA256 hash of content for change detection"""
-    return hashlib.sha256(text.encode("utf-8", errors="ignore")).hexdigest()
+def content_hash(text: str, alg: Optional[str] = None) -> str:
+    """Hash content for change detection (64 hex chars for both algorithms)"""
+    data = text.encode("utf-8", errors="ignore")
+    if (alg or HASH_ALG) == "blake3" and blake3 is not None:
+        return blake3.blake3(data).hexdigest()
+    return hashlib.sha256(data).hexdigest()
 
 def _chunk_text(text: str, target_words: int = 220, overlap_words: int = 40) -> List[str]:
-    """Word-based chunking with overlap for better context preservation"""
+    """Word-based chunking with overlap for better context preservation
+
+    Linear in the text length: one split, then one join per chunk. Words carry no
+    whitespace, so the joined chunk needs no strip.
+    """
     words = text.split()
-    if not words:
+    n = len(words)
+    if not n:
         return []
-    chunks = []
     step = max(1, target_words - overlap_words)
-    for i in range(0, len(words), step):
-        segment = words[i : i + target_words]
-        if not segment:
-            break
-        chunks.append(" ".join(segment).strip())
-        if i + target_words >= len(words):
-            break
-    return chunks
+    # Last window start that still needs its own chunk
+    last = max(0, n - target_words)
+    starts = list(range(0, last + 1, step))
+    if starts[-1] < last:
+        starts.append(starts[-1] + step)
+    return [" ".join(words[i : i + target_words]) for i in starts]
+
+def _chunk_and_hash(text: str) -> List[Tuple[str, str]]:
+    """Chunk text and hash each chunk as it is built: [(chunk, chunk_hash), ...]"""
+    return [(chunk, content_hash(chunk)) for chunk in _chunk_text(text)]
 
 # -----------------------------
 # Main Vector Store
@@ -80,13 +275,24 @@ class MemcacheS3VectorStore:
         self.ready: bool = False
         self.last_updated: Optional[str] = None
         self.batch_size: int = _DEF_BATCH_SIZE
-        self.embedding_dim: Optional[int] = None
+        self.embedding_dim: Optional[int] = _MODEL_DIMS.get(model_name)
+        self._ready_probed_at = 0.0
+        # (normalized question, max_results) -> answer dict; cleared whenever this KB changes
+        self._answer_cache: TTLCache = TTLCache(maxsize=_ANSWER_CACHE_SIZE, ttl=_ANSWER_CACHE_TTL)
+
+        # Tenant conditions never change for a store; build the filter models once
+        self._tenant_conditions = [
+            FieldCondition(key="tenant_id", match=MatchValue(value=self.user_id)),
+            FieldCondition(key="kb_id", match=MatchValue(value=self.knowledge_base_id)),
+        ]
+        self._tenant_only_filter = Filter(must=self._tenant_conditions)
 
         # Configure Google APIs
         google_api_key = _env("GOOGLE_API_KEY")
         if not google_api_key:
             raise ValueError("GOOGLE_API_KEY environment variable is required")
         genai.configure(api_key=google_api_key)
+        self._gen_model = genai.GenerativeModel(_ANSWER_MODEL)
 
         # Single collection with tenant filtering (more scalable)
         self.collection_name = os.getenv("QDRANT_COLLECTION", "kb_chunks")
@@ -99,12 +305,15 @@ class MemcacheS3VectorStore:
         """Initialize Qdrant client"""
         url = _env("QDRANT_URL", "http://localhost:6333")
         api_key = _env("QDRANT_API_KEY")
+        # REST by default; set QDRANT_GRPC=true only where the gRPC port (6334) is reachable
         prefer_grpc = _env("QDRANT_GRPC", "false").lower() in {"1", "true", "yes"}
+        grpc_port = int(_env("QDRANT_GRPC_PORT", "6334"))
 
         if "qdrant:6333" in url:
             url = url.replace("qdrant:6333", "localhost:6333")
 
-        client = QdrantClient(url=url, api_key=api_key, prefer_grpc=prefer_grpc, timeout=60)
+        client = QdrantClient(url=url, api_key=api_key, prefer_grpc=prefer_grpc,
+                              grpc_port=grpc_port, timeout=60)
 
         try:
             _ = client.get_collections()
@@ -122,7 +331,11 @@ class MemcacheS3VectorStore:
             vec = await self._embed_text("dimension probe")
             if vec is None:
                 raise RuntimeError("Embedding failed. Check GOOGLE_API_KEY.")
-            self.embedding_dim = len(vec)
+            self.embedding_dim = _MODEL_DIMS[self.model_name] = len(vec)
+
+        if self.collection_name in _KNOWN_COLLECTIONS:
+            self._ensure_payload_indexes()
+            return
 
         try:
             existing = self.client.get_collections().collections
@@ -131,15 +344,51 @@ class MemcacheS3VectorStore:
             if self.collection_name not in names:
                 self.client.create_collection(
                     collection_name=self.collection_name,
-                    vectors_config=VectorParams(size=self.embedding_dim, distance=Distance.COSINE),
+                    vectors_config=VectorParams(size=self.embedding_dim, distance=Distance.COSINE, on_disk=True),
+                    quantization_config=_QUANTIZATION,
                 )
                 logger.info("✅ Created collection '%s' (dim=%d)", self.collection_name, self.embedding_dim)
+            else:
+                self._ensure_quantization()
+            _KNOWN_COLLECTIONS.add(self.collection_name)
         except Exception as e:
             logger.error("Error ensuring collection: %s", e)
             raise
 
+        self._ensure_payload_indexes()
+
+    def _ensure_quantization(self) -> None:
+        """Turn on int8 scalar quantization for a collection created before it was the default"""
+        try:
+            info = self.client.get_collection(self.collection_name)
+            if info.config.quantization_config is None:
+                self.client.update_collection(
+                    collection_name=self.collection_name,
+                    quantization_config=_QUANTIZATION,
+                )
+                logger.info("✅ Enabled int8 quantization on '%s'", self.collection_name)
+        except Exception as e:
+            logger.warning("Could not enable quantization on %s: %s", self.collection_name, e)
+
+    def _ensure_payload_indexes(self) -> None:
+        """Create keyword indexes on the filter fields (once per collection per process)"""
+        if self.collection_name in _INDEXED_COLLECTIONS:
+            return
+        for field in _FILTER_FIELDS:
+            try:
+                self.client.create_payload_index(
+                    collection_name=self.collection_name,
+                    field_name=field,
+                    field_schema=models.PayloadSchemaType.KEYWORD,
+                )
+            except Exception as e:
+                logger.warning("Could not create payload index on %s: %s", field, e)
+                return
+        _INDEXED_COLLECTIONS.add(self.collection_name)
+
     def _load_existing_data(self) -> None:
         """Check if we have existing data"""
+        self._ready_probed_at = time.monotonic()
         try:
             count = self.get_total_chunks()
             if count > 0:
@@ -152,7 +401,8 @@ class MemcacheS3VectorStore:
     def _point_id(self, source_id: str, chunk_index: int) -> str:
         """Generate deterministic UUID-format point ID for safe upserts"""
         base = f"{self.user_id}:{self.knowledge_base_id}:{source_id}:{chunk_index}"
-        hash_hex = content_hash(base)
+        # Always SHA256: IDs must stay stable regardless of HASH_ALG
+        hash_hex = hashlib.sha256(base.encode("utf-8", errors="ignore")).hexdigest()
         
         # Convert first 32 chars of hash to UUID format
         # xxxxxxxx-xxxx-xxxx-xxxx-xxxxxxxxxxxx
@@ -160,112 +410,219 @@ class MemcacheS3VectorStore:
         return uuid_str
 
     def _tenant_filter(self, extra: Optional[List] = None) -> Filter:
-        """Create filter for this tenant+KB"""
-        conditions = [
-            FieldCondition(key="tenant_id", match=MatchValue(value=self.user_id)),
-            FieldCondition(key="kb_id", match=MatchValue(value=self.knowledge_base_id)),
-        ]
-        if extra:
-            conditions.extend(extra)
-        return Filter(must=conditions)
+        """Create filter for this tenant+KB (the shared prebuilt one when there are no extras)"""
+        if not extra:
+            return self._tenant_only_filter
+        return Filter(must=[*self._tenant_conditions, *extra])
 
     def _get_existing_points_for_source(self, source_id: str) -> List:
         """Get all existing points for a source"""
+        return self._get_existing_points_by_source([source_id]).get(source_id, [])
+
+    def _get_existing_points_by_source(self, source_ids: List[str]) -> Dict[str, List]:
+        """Get existing points for many sources with paginated scrolls, grouped by source_id"""
+        grouped: Dict[str, List] = defaultdict(list)
+        unique_ids = list(dict.fromkeys(source_ids))
         try:
-            filter_condition = self._tenant_filter([
-                FieldCondition(key="source_id", match=MatchValue(value=source_id))
-            ])
-            
-            collected = []
-            offset = None
-            while True:
-                response = self.client.scroll(
-                    collection_name=self.collection_name,
-                    scroll_filter=filter_condition,
-                    limit=256,
-                    offset=offset,
-                    with_payload=True,
-                    with_vectors=False,
-                )
-                points, offset = response
-                collected.extend(points or [])
-                if offset is None or not points:
-                    break
-            return collected
+            for i in range(0, len(unique_ids), _SOURCES_PER_SCROLL):
+                filter_condition = self._tenant_filter([
+                    FieldCondition(key="source_id", match=MatchAny(any=unique_ids[i:i + _SOURCES_PER_SCROLL]))
+                ])
+                offset = None
+                while True:
+                    points, offset = self.client.scroll(
+                        collection_name=self.collection_name,
+                        scroll_filter=filter_condition,
+                        limit=_SCROLL_PAGE_SIZE,
+                        offset=offset,
+                        with_payload=_CHANGE_FIELDS,
+                        with_vectors=False,
+                    )
+                    for point in points or []:
+                        grouped[point.payload.get("source_id")].append(point)
+                    if offset is None or not points:
+                        break
         except Exception as e:
             logger.warning("Error fetching existing points: %s", e)
-            return []
+        return grouped
 
-    async def _generate_embeddings_google(self, texts: List[str]) -> List[List[float]]:
-        """Generate embeddings using Google API with parallel processing"""
+    def _embed_batch(self, texts: List[str]) -> List[Optional[List[float]]]:
+        """Embed a list of texts in one embed_content request (blocking)"""
+        try:
+            r = genai.embed_content(model=self.model_name, content=texts, task_type="retrieval_document")
+            embs = r["embedding"] if isinstance(r, dict) else getattr(r, "embedding", None)
+            if embs and len(embs) == len(texts):
+                return embs
+            logger.error("Embedding batch returned %d vectors for %d texts", len(embs or []), len(texts))
+        except Exception as e:
+            logger.error("Embedding error: %s", e)
+        return [None] * len(texts)
+
+    async def _generate_embeddings_google(self, texts: List[str],
+                                          hashes: Optional[List[str]] = None) -> List[Optional[np.ndarray]]:
+        """Generate embeddings using batched Google API requests dispatched in parallel
+
+        Texts already in the embedding cache (or repeated within `texts`) are only
+        sent once. `hashes` are the texts' content hashes, if the caller has them.
+        Returns one vector per input text, in input order; None where embedding failed.
+        """
         if not texts:
             return []
 
-        logger.info("🔄 Processing %d texts with Google Embedding API", len(texts))
-
-        loop = asyncio.get_event_loop()
-        executor = ThreadPoolExecutor(max_workers=_DEF_MAX_WORKERS)
+        if hashes is None:
+            hashes = [content_hash(t) for t in texts]
+        keys = [f"{self.model_name}:{h}" for h in hashes]
+
+        vectors: List[Optional[np.ndarray]] = [None] * len(texts)
+        fresh: Dict[str, np.ndarray] = {}
+        misses: Dict[str, int] = {}  # cache key -> index of the first text to embed
+        for i, key in enumerate(keys):
+            vec = _EMB_CACHE.get(key)
+            if vec is not None:
+                vectors[i] = vec
+            elif key not in misses:
+                misses[key] = i
+
+        if misses:
+            logger.info("🔄 Processing %d texts with Google Embedding API (%d cached)",
+                        len(misses), len(texts) - len(misses))
+
+            # Length-sorted batches keep each request's texts similar in size
+            order = sorted(misses.values(), key=lambda i: len(texts[i]))
+            batches = [order[i:i + self.batch_size] for i in range(0, len(order), self.batch_size)]
+
+            results = await asyncio.gather(*[
+                _run_embed(self._embed_batch, [texts[i] for i in batch]) for batch in batches
+            ])
 
-        def _embed(text: str) -> Optional[List[float]]:
-            try:
-                r = genai.embed_content(model=self.model_name, content=text, task_type="retrieval_document")
-                emb = r["embedding"] if isinstance(r, dict) else getattr(r, "embedding", None)
-                return emb
-            except Exception as e:
-                logger.error("Embedding error: %s", e)
-                return None
+            dim = self.embedding_dim
+            for batch, embs in zip(batches, results):
+                for i, emb in zip(batch, embs):
+                    if emb and (dim is None or len(emb) == dim):
+                        fresh[keys[i]] = np.asarray(emb, dtype=np.float32)
+
+            if _EMB_CACHE_SIZE > 0:
+                _EMB_CACHE.update(fresh)
+
+        # Fill in every text embedded in this call, duplicates included
+        for i, key in enumerate(keys):
+            if vectors[i] is None:
+                vectors[i] = fresh.get(key)
+        return vectors
+
+    def _stored_vectors_by_hash(self, existing_points: List, wanted: set) -> Dict[str, np.ndarray]:
+        """Fetch stored vectors of existing chunks whose hash is in `wanted`"""
+        ids_by_hash: Dict[str, str] = {}
+        for p in existing_points:
+            h = p.payload.get("chunk_hash")
+            if h in wanted and p.payload.get("hash_alg", "sha256") == HASH_ALG:
+                ids_by_hash.setdefault(h, p.id)
+        if not ids_by_hash:
+            return {}
 
-        futures = [loop.run_in_executor(executor, _embed, t) for t in texts]
-        results = await asyncio.gather(*futures)
+        try:
+            records = self.client.retrieve(
+                collection_name=self.collection_name,
+                ids=list(ids_by_hash.values()),
+                with_payload=False,
+                with_vectors=True,
+            )
+        except Exception as e:
+            logger.warning("Could not fetch stored vectors: %s", e)
+            return {}
 
-        dim = self.embedding_dim or 768
-        return [r if (r and isinstance(r, list) and len(r) == dim) else [0.0] * dim for r in results]
+        vec_by_id = {str(r.id): r.vector for r in records if r.vector}
+        return {
+            h: np.asarray(vec_by_id[str(pid)], dtype=np.float32)
+            for h, pid in ids_by_hash.items() if str(pid) in vec_by_id
+        }
 
     async def _embed_text(self, text: str) -> Optional[List[float]]:
-        """Embed single text"""
+        """Embed single text (off the event loop)"""
         if not text.strip():
             return None
-        try:
-            r = genai.embed_content(model=self.model_name, content=text, task_type="retrieval_document")
-            return r["embedding"] if isinstance(r, dict) else getattr(r, "embedding", None)
-        except Exception as e:
-            logger.error("Embedding error: %s", e)
-            return None
-
-    async def _process_single_source(self, text: str, source_id: str, extra_meta: Dict) -> int:
-        """Process single source with incremental updates"""
+        return (await _run_embed(self._embed_batch, [text]))[0]
+
+    async def _process_single_source(self, text: str, source_id: str, extra_meta: Dict,
+                                     existing_points: Optional[List] = None,
+                                     pending: Optional[_PointBuffer] = None,
+                                     now_iso: Optional[str] = None) -> int:
+        """Process single source with incremental updates
+
+        When `pending` is given, new points are appended to it for the caller to
+        flush in bulk instead of being upserted here. `now_iso` is the batch's
+        timestamp, computed once by the caller.
+        """
         text = (text or "").strip()
         if not text:
             return 0
 
-        # Create chunks
-        chunks = _chunk_text(text)
-        if not chunks:
+        # Get existing points for this source (unless the caller preloaded them)
+        if existing_points is None:
+            existing_points = self._get_existing_points_for_source(source_id)
+
+        # Whole-source short-circuit: a length mismatch means changed without hashing;
+        # an equal length needs one hash of the text, and no chunking if it matches
+        source_len = len(text)
+        source_hash = None
+        if existing_points and all(p.payload.get("source_len") == source_len for p in existing_points):
+            source_hash = content_hash(text)
+            if all(p.payload.get("source_hash") == source_hash for p in existing_points):
+                return 0
+
+        # Chunk and hash in one pass; each chunk is hashed while it is still hot
+        hashed_chunks = _chunk_and_hash(text)
+        if not hashed_chunks:
             return 0
 
-        # Get existing points for this source
-        existing_points = self._get_existing_points_for_source(source_id)
         existing_by_index = {p.payload.get("chunk_index"): p for p in existing_points}
 
-        # Prepare new/changed chunks
-        points_to_upsert = []
-        upsert_count = 0
-
-        for idx, chunk in enumerate(chunks):
-            chunk_hash = content_hash(chunk)
-            point_id = self._point_id(source_id, idx)
-            
+        # Find new/changed chunks
+        changed = []
+        for idx, (chunk, chunk_hash) in enumerate(hashed_chunks):
             # Check if chunk changed
             existing_point = existing_by_index.get(idx)
-            existing_hash = existing_point.payload.get("chunk_hash") if existing_point else None
-            
-            if existing_hash == chunk_hash:
-                continue  # Unchanged, skip
-            
-            # Embed new/changed chunk
-            vec = await self._embed_text(chunk)
+            if existing_point is not None:
+                existing_hash = existing_point.payload.get("chunk_hash")
+                # Chunks stored before hash_alg existed were hashed with SHA256
+                existing_alg = existing_point.payload.get("hash_alg", "sha256")
+                if existing_alg != HASH_ALG:
+                    if content_hash(chunk, existing_alg) == existing_hash:
+                        continue  # Unchanged, skip
+                elif existing_hash == chunk_hash:
+                    continue  # Unchanged, skip
+
+            changed.append((idx, chunk, chunk_hash))
+
+        updated_at = now_iso or _now_iso()
+
+        # Chunks that only moved position (text inserted/removed above them) reuse
+        # their stored vectors; embed the rest in batched requests
+        reused = self._stored_vectors_by_hash(
+            existing_points, {chunk_hash for _, _, chunk_hash in changed}
+        )
+        to_embed = [(chunk, chunk_hash) for _, chunk, chunk_hash in changed if chunk_hash not in reused]
+        embedded = await self._generate_embeddings_google(
+            [chunk for chunk, _ in to_embed], [chunk_hash for _, chunk_hash in to_embed]
+        )
+        reused.update({chunk_hash: vec for (_, chunk_hash), vec in zip(to_embed, embedded)})
+        vectors = [reused.get(chunk_hash) for _, _, chunk_hash in changed]
+
+        # Stamp the source only when every chunk got a vector: a stamped source is
+        # skipped wholesale next time, which would never retry the failed chunks
+        if all(vec is not None for vec in vectors):
+            source_stamp = {"source_len": source_len, "source_hash": source_hash or content_hash(text)}
+        else:
+            source_stamp = {}
+            logger.warning("Some chunks of %s failed to embed; source left unstamped for retry", source_id)
+
+        points = pending if pending is not None else _PointBuffer()
+        upsert_count = 0
+
+        for (idx, chunk, chunk_hash), vec in zip(changed, vectors):
             if vec is None:
                 continue
+            point_id = self._point_id(source_id, idx)
 
             payload = {
                 "tenant_id": self.user_id,
@@ -274,40 +631,70 @@ class MemcacheS3VectorStore:
                 "text": chunk,
                 "chunk_index": idx,
                 "chunk_hash": chunk_hash,
-                "updated_at": _now_iso(),
+                "hash_alg": HASH_ALG,
+                **source_stamp,
+                "updated_at": updated_at,
                 **extra_meta
             }
 
-            points_to_upsert.append(PointStruct(
-                id=point_id,
-                vector=vec,
-                payload=payload
-            ))
+            points.add(point_id, vec, payload)
             upsert_count += 1
 
-        # Upsert changed/new chunks
-        if points_to_upsert:
-            batch_size = max(128, self.batch_size)
-            for i in range(0, len(points_to_upsert), batch_size):
-                batch = points_to_upsert[i:i + batch_size]
-                self.client.upsert(collection_name=self.collection_name, points=batch, wait=True)
+        # Upsert changed/new chunks (a caller-supplied buffer is flushed by the caller)
+        if pending is None:
+            self._upload_points(points)
 
         # Delete removed chunks
-        new_indices = set(range(len(chunks)))
+        new_indices = set(range(len(hashed_chunks)))
         points_to_delete = []
         for idx, point in existing_by_index.items():
             if idx not in new_indices:
                 points_to_delete.append(point.id)
 
+        # Qdrant applies a collection's updates in order, so when the caller's
+        # final flush waits these intermediate writes need not block on it
+        wait = pending is None
+
         if points_to_delete:
             self.client.delete(
                 collection_name=self.collection_name,
                 points_selector=points_to_delete,
-                wait=True
+                wait=wait
+            )
+
+        # Stamp the kept, unchanged chunks too so the next unchanged run short-circuits
+        # (new points already carry the stamp in their payload)
+        upserted = {idx for idx, _, _ in changed}
+        unchanged_ids = [
+            p.id for idx, p in existing_by_index.items()
+            if idx in new_indices and idx not in upserted
+        ]
+        if unchanged_ids and source_stamp:
+            self.client.set_payload(
+                collection_name=self.collection_name,
+                payload=source_stamp,
+                points=unchanged_ids,
+                wait=wait,
             )
 
         return upsert_count
 
+    def _upload_points(self, points: _PointBuffer) -> None:
+        """Upload buffered points as a float32 matrix in large batches"""
+        if not len(points):
+            return
+        # Worker processes only pay off for big flushes
+        parallel = _UPLOAD_PARALLEL if len(points) > 4 * _UPSERT_BATCH else 1
+        self.client.upload_collection(
+            collection_name=self.collection_name,
+            vectors=points.vectors,
+            payload=points.payloads,
+            ids=points.ids,
+            batch_size=_UPSERT_BATCH,
+            parallel=parallel,
+            wait=True,
+        )
+
     # -----------------------------
     # Public API
     # -----------------------------
@@ -321,16 +708,42 @@ class MemcacheS3VectorStore:
 
         if clear_existing:
             self.clear_data(silent=True)
+            existing_by_source: Dict[str, List] = {}
+        else:
+            # One paginated bulk scroll for every page in the batch instead of one per page
+            existing_by_source = self._get_existing_points_by_source([
+                page.get("final_url") or page.get("url") or "" for page in pages
+            ])
+
+        pending = _PointBuffer()
+        now_iso = _now_iso()  # one timestamp for the whole batch
+        page_sem = asyncio.Semaphore(_DEF_PAGE_CONCURRENCY)
+
+        # Full buffers go to a bounded queue drained by one uploader, so uploads
+        # overlap with chunking/embedding and peak memory stays at a few buffers
+        upload_queue: asyncio.Queue = asyncio.Queue(maxsize=2)
+        upload_errors: List[Exception] = []
 
-        total_upserts = 0
-        for page in pages:
+        async def uploader() -> None:
+            while True:
+                buf = await upload_queue.get()
+                if buf is None:
+                    return
+                if upload_errors:
+                    continue  # keep draining so producers never block
+                try:
+                    await asyncio.to_thread(self._upload_points, buf)
+                except Exception as e:
+                    upload_errors.append(e)
+
+        async def process_page(page: Dict) -> int:
             try:
                 url = page.get("final_url") or page.get("url") or ""
                 content = page.get("text") or page.get("content") or ""
                 title = page.get("title") or ""
                 
                 if not url or not content.strip():
-                    continue
+                    return 0
 
                 extra_meta = {
                     "url": url,
@@ -338,17 +751,44 @@ class MemcacheS3VectorStore:
                     "source_type": "web",
                     "framework": page.get("framework", "unknown"),
                     "word_count": page.get("word_count", 0),
-                    "scraped_at": page.get("scraped_at", _now_iso()),
+                    "scraped_at": page.get("scraped_at") or now_iso,
                 }
 
-                upserts = await self._process_single_source(content, url, extra_meta)
-                total_upserts += upserts
+                page_points = _PointBuffer()
+                async with page_sem:
+                    count = await self._process_single_source(
+                        content, url, extra_meta, existing_by_source.get(url, []), page_points, now_iso
+                    )
+
+                nonlocal pending
+                pending.extend(page_points)
+                if len(pending) >= _FLUSH_POINTS:
+                    full, pending = pending, _PointBuffer()
+                    await upload_queue.put(full)
+                return count
 
             except Exception as e:
                 logger.error("Error processing page %s: %s", page.get("url", ""), e)
+                return 0
+
+        upload_task = asyncio.create_task(uploader())
+        try:
+            # Pages overlap: one page chunks while others wait on embedding requests
+            total_upserts = sum(await asyncio.gather(*[process_page(page) for page in pages]))
+
+            # Final flush of the remainder; it waits, so ready=True covers every earlier write
+            await upload_queue.put(pending)
+            await upload_queue.put(None)
+            await upload_task
+            if upload_errors:
+                raise upload_errors[0]
+        finally:
+            if not upload_task.done():
+                upload_task.cancel()
 
         self.ready = True
-        self.last_updated = _now_iso()
+        self.last_updated = now_iso
+        self._answer_cache.clear()
         
         logger.info("✅ Processed %d pages, %d chunks upserted in %.2fs", 
                    len(pages), total_upserts, time.time() - start)
@@ -364,7 +804,9 @@ class MemcacheS3VectorStore:
             if not text_content.strip():
                 return 0
 
-            source_id = metadata.get("source_url") or metadata.get("doc_id") or f"doc_{uuid.uuid4()}"
+            # Content-derived fallback: re-uploading the same text maps to the same points
+            source_id = (metadata.get("source_url") or metadata.get("doc_id")
+                         or "doc_" + hashlib.sha256(text_content.strip().encode("utf-8", errors="ignore")).hexdigest()[:32])
             
             extra_meta = {
                 "source_type": "document",
@@ -377,6 +819,7 @@ class MemcacheS3VectorStore:
             
             self.ready = True
             self.last_updated = _now_iso()
+            self._answer_cache.clear()
 
             logger.info("Added %d chunks from document: %s", upserts, extra_meta.get("title"))
             return upserts
@@ -395,15 +838,28 @@ class MemcacheS3VectorStore:
             return []
         
         try:
-            qvec = await self._embed_text(query)
-            if not qvec:
+            query = query.strip()
+            if not query:
                 return []
-
-            results = self.client.search(
+            qkey = (self.model_name, query)
+            qvec = _QUERY_VEC_CACHE.get(qkey)
+            if qvec is None:
+                # Concurrent searches share one coalesced embed_content request
+                qvec = await _QUERY_BATCHER.embed(self.model_name, query)
+                if not qvec:
+                    return []
+                if _QUERY_CACHE_SIZE > 0:
+                    _QUERY_VEC_CACHE[qkey] = qvec
+
+            # The client is synchronous; run the round trip on a worker thread so
+            # concurrent searches don't queue behind each other on the event loop
+            results = await asyncio.to_thread(
+                self.client.search,
                 collection_name=self.collection_name,
                 query_vector=qvec,
                 limit=max_results,
                 query_filter=self._tenant_filter(),
+                search_params=_SEARCH_PARAMS,
                 with_payload=True,
             )
 
@@ -435,6 +891,12 @@ class MemcacheS3VectorStore:
                 "confidence": 0.0,
             }
 
+        # Repeated questions ("what is your pricing?") skip both the search and the LLM call
+        key = (" ".join(question.lower().split()), max_results)
+        cached = self._answer_cache.get(key)
+        if cached is not None:
+            return cached
+
         try:
             chunks = await self.semantic_search(question, max_results)
             if not chunks:
@@ -451,7 +913,10 @@ class MemcacheS3VectorStore:
             # Simple confidence from top score
             confidence = chunks[0]["score"] if chunks else 0.0
             
-            return {"answer": answer, "sources": sources, "confidence": confidence}
+            result = {"answer": answer, "sources": sources, "confidence": confidence}
+            if answer != _ANSWER_FALLBACK:  # never cache a failed generation
+                self._answer_cache[key] = result
+            return result
 
         except Exception as e:
             logger.error("Query processing error: %s", e)
@@ -461,26 +926,78 @@ class MemcacheS3VectorStore:
                 "confidence": 0.0
             }
 
+    async def stream_query(self, question: str, max_results: int = _DEF_SEARCH_LIMIT) -> AsyncIterator[Dict]:
+        """Like process_query, but yields the answer as it is generated
+
+        Yields {"type": "token", "text": ...} events followed by one
+        {"type": "done", "sources": ..., "confidence": ...} event. If generation
+        fails part-way, an {"type": "error", "text": ...} event precedes "done".
+        """
+        key = (" ".join(question.lower().split()), max_results)
+        cached = self._answer_cache.get(key)
+        if cached is not None:
+            yield {"type": "token", "text": cached["answer"]}
+            yield {"type": "done", "sources": cached["sources"], "confidence": cached["confidence"]}
+            return
+
+        chunks = await self.semantic_search(question, max_results) if self.is_ready() else []
+        if not chunks:
+            yield {"type": "token", "text": "I couldn't find relevant information to answer your question."}
+            yield {"type": "done", "sources": [], "confidence": 0.0}
+            return
+
+        context = "\n\n".join([c["text"] for c in chunks])
+        sources = [c["metadata"] for c in chunks]
+        confidence = chunks[0]["score"]
+
+        parts = []
+        failed = False
+        try:
+            # First tokens reach the client after one round trip instead of the full generation
+            resp = await self._gen_model.generate_content_async(
+                self._answer_prompt(question, context), stream=True
+            )
+            async for part in resp:
+                text = getattr(part, "text", None)
+                if text:
+                    parts.append(text)
+                    yield {"type": "token", "text": text}
+        except Exception as e:
+            logger.error("Answer streaming error: %s", e)
+            failed = True
+
+        if failed:
+            # Partial text is never cached; the client is told the answer is incomplete
+            yield {"type": "error", "text": _ANSWER_FALLBACK}
+        elif parts:
+            self._answer_cache[key] = {"answer": "".join(parts), "sources": sources, "confidence": confidence}
+        else:
+            yield {"type": "token", "text": _ANSWER_FALLBACK}
+        yield {"type": "done", "sources": sources, "confidence": confidence}
+
+    @staticmethod
+    def _answer_prompt(question: str, context: str) -> str:
+        """Gemini prompt shared by the buffered and streaming answer paths"""
+        return "".join((_PROMPT_HEAD, context, _PROMPT_QUESTION, question, _PROMPT_TAIL))
+
     async def _generate_answer_google(self, question: str, context: str) -> str:
         """Generate answer using Google Gemini"""
         try:
-            model = genai.GenerativeModel("gemini-2.0-flash")
-            prompt = (
-                "You are a helpful sales assistant. Based on the following information, "
-                "concisely answer the customer's question and focus on how our features can help them.\n\n"
-                f"Information:\n{context}\n\n"
-                f"Customer Question: {question}\n\n"
-                "Answer as a knowledgeable sales assistant. If you don't have the specific information needed, say you'll get back to them."
-            )
-            resp = model.generate_content(prompt)
-            return getattr(resp, "text", None) or "I'll get back to you with that information."
+            prompt = self._answer_prompt(question, context)
+            # Async call: a multi-second generation no longer blocks every other request on this worker
+            resp = await self._gen_model.generate_content_async(prompt)
+            return getattr(resp, "text", None) or _ANSWER_FALLBACK
         except Exception as e:
             logger.error("Answer generation error: %s", e)
-            return "I'll get back to you with that information."
+            return _ANSWER_FALLBACK
 
     def is_ready(self) -> bool:
-        """Check if vector store is ready"""
+        """Check if vector store is ready (a not-ready KB is re-probed at most every IS_READY_TTL seconds)"""
         if not self.ready:
+            now = time.monotonic()
+            if now - self._ready_probed_at < _READY_PROBE_TTL:
+                return False
+            self._ready_probed_at = now
             try:
                 count = self.get_total_chunks()
                 if count > 0:
@@ -506,11 +1023,12 @@ class MemcacheS3VectorStore:
         try:
             self.client.delete(
                 collection_name=self.collection_name,
-                points_selector=self._tenant_filter(),
+                points_selector=models.FilterSelector(filter=self._tenant_filter()),
                 wait=True,
             )
             self.ready = False
             self.last_updated = None
+            self._answer_cache.clear()
             if not silent:
                 logger.info("🗑️ Cleared all data for %s/%s", self.user_id, self.knowledge_base_id)
         except Exception as e:
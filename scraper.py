@@ -1,21 +1,41 @@
 # advanced_scraper.py - Playwright scraper that handles JavaScript websites
 import asyncio
+import functools
 import logging
+import os
 import time
 import random
 from typing import List, Dict, Optional
 from urllib.parse import urljoin, urlparse
 import re
-from pydantic import BaseModel
-from typing import List
 
 # Proper Playwright imports
 from playwright.async_api import async_playwright, Browser, BrowserContext, Page
-from bs4 import BeautifulSoup
-import httpx
 
 logger = logging.getLogger(__name__)
 
+# Common UI text dropped during cleaning, matched in one pass per line
+_SKIP_LINE_RE = re.compile("|".join(re.escape(p) for p in [
+    'loading', 'please wait', 'skip to', 'menu', 'search',
+    'cookie', 'privacy policy', 'terms of service',
+    'subscribe', 'sign up', 'login', 'log in',
+    'javascript', 'enable cookies', 'browser support'
+]))
+
+# Subresources the text extraction never reads. Stylesheets stay enabled because the
+# SPA wait checks loader visibility via layout (offsetWidth/offsetHeight).
+BLOCKED_RESOURCE_TYPES = {'image', 'media', 'font'}
+
+# Pages rendered concurrently per crawl (each worker keeps its own human-like delay)
+SCRAPE_CONCURRENCY = int(os.getenv("SCRAPER_CONCURRENCY", "8"))
+
+@functools.lru_cache(maxsize=64)
+def _substring_matcher(patterns: tuple):
+    """Compile URL include/exclude substrings into one case-insensitive alternation (None if empty)"""
+    if not patterns:
+        return None
+    return re.compile("|".join(re.escape(p) for p in patterns), re.IGNORECASE)
+
 class AdvancedPlaywrightScraper:
     """Advanced Playwright scraper that handles JavaScript-heavy websites"""
     
@@ -38,55 +58,77 @@ class AdvancedPlaywrightScraper:
         logger.info(f"⚡ JavaScript rendering enabled")
         
         pages_data = []
-        urls_to_visit = [base_url]
-        visited_urls = set()
+        queue: asyncio.Queue = asyncio.Queue()
+        queue.put_nowait(base_url)
+        seen_urls = {base_url}  # queued or visited
+        scheduled = 0
+        browser_dead = False
+        recover_lock = asyncio.Lock()
         
-        try:
-            # Initialize advanced browser setup
-            await self._init_advanced_browser()
-            
-            for i, url in enumerate(urls_to_visit[:max_pages]):
-                if url in visited_urls:
-                    continue
-                    
-                visited_urls.add(url)
-                logger.info(f"🔄 Scraping ({i+1}/{min(max_pages, len(urls_to_visit))}): {url}")
-                
+        async def worker():
+            nonlocal scheduled, browser_dead
+            while True:
+                url = await queue.get()
                 try:
-                    # Advanced page scraping with JavaScript handling
-                    page_data = await self._scrape_page_with_js(url)
+                    # Keep draining once done so queue.join() returns
+                    if browser_dead or scheduled >= max_pages:
+                        continue
+                    scheduled += 1
+                    logger.info(f"🔄 Scraping ({scheduled}/{max_pages}): {url}")
                     
-                    if page_data and page_data.get('content'):
-                        pages_data.append(page_data)
-                        logger.info(f"✅ Success: {len(page_data['content'])} chars - '{page_data['title'][:50]}'")
+                    try:
+                        # Advanced page scraping with JavaScript handling
+                        page_data = await self._scrape_page_with_js(url)
                         
-                        # Extract URLs from JavaScript-rendered content
-                        new_urls = self._extract_urls_enhanced(
-                            page_data.get('links', []), base_url, include_patterns, exclude_patterns
-                        )
+                        if page_data and page_data.get('content'):
+                            pages_data.append(page_data)
+                            logger.info(f"✅ Success: {len(page_data['content'])} chars - '{page_data['title'][:50]}'")
+                            
+                            # Extract URLs from JavaScript-rendered content
+                            new_urls = self._extract_urls_enhanced(
+                                page_data.get('links', []), base_url, include_patterns, exclude_patterns
+                            )
+                            
+                            for new_url in new_urls:
+                                if new_url not in seen_urls:
+                                    seen_urls.add(new_url)
+                                    queue.put_nowait(new_url)
+                                    
+                            logger.info(f"   🔗 Found {len(new_urls)} new URLs")
+                        else:
+                            logger.warning(f"⚠️  No content extracted from {url}")
                         
-                        for new_url in new_urls:
-                            if new_url not in visited_urls and new_url not in urls_to_visit:
-                                urls_to_visit.append(new_url)
-                                
-                        logger.info(f"   🔗 Found {len(new_urls)} new URLs")
-                    else:
-                        logger.warning(f"⚠️  No content extracted from {url}")
-                    
-                    # Human-like delay
-                    delay = random.uniform(3, 7)
-                    logger.info(f"   ⏳ Waiting {delay:.1f}s (human-like behavior)...")
-                    await asyncio.sleep(delay)
-                    
-                except Exception as e:
-                    logger.error(f"❌ Error scraping {url}: {e}")
-                    # Try to recover browser
-                    try:
-                        await self._recover_browser()
-                    except Exception as recover_error:
-                        logger.error(f"Browser recovery failed: {recover_error}")
-                        break  # Exit if browser can't be recovered
-                    continue
+                        # Human-like delay (per worker, so the site sees at most SCRAPE_CONCURRENCY pages at once)
+                        delay = random.uniform(3, 7)
+                        logger.info(f"   ⏳ Waiting {delay:.1f}s (human-like behavior)...")
+                        await asyncio.sleep(delay)
+                        
+                    except Exception as e:
+                        logger.error(f"❌ Error scraping {url}: {e}")
+                        # Try to recover browser (one worker at a time)
+                        async with recover_lock:
+                            if browser_dead:
+                                continue
+                            try:
+                                await self._recover_browser()
+                            except Exception as recover_error:
+                                logger.error(f"Browser recovery failed: {recover_error}")
+                                browser_dead = True  # Stop if browser can't be recovered
+                finally:
+                    queue.task_done()
+        
+        try:
+            # Initialize advanced browser setup
+            await self._init_advanced_browser()
+            
+            # Pages share one context; each worker opens and closes its own tab
+            workers = [asyncio.create_task(worker()) for _ in range(max(1, min(SCRAPE_CONCURRENCY, max_pages)))]
+            try:
+                await queue.join()
+            finally:
+                for task in workers:
+                    task.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
                     
         except Exception as e:
             logger.error(f"💥 Fatal scraping error: {e}")
@@ -215,12 +257,22 @@ class AdvancedPlaywrightScraper:
                 };
             """)
             
+            # Drop heavy subresources for every page in this context
+            await self.context.route("**/*", self._handle_route)
+            
             logger.info("✅ Advanced browser initialized with anti-detection")
             
         except Exception as e:
             logger.error(f"Failed to initialize advanced browser: {e}")
             raise
     
+    async def _handle_route(self, route):
+        """Abort images, media and fonts; let everything else through"""
+        if route.request.resource_type in BLOCKED_RESOURCE_TYPES:
+            await route.abort()
+        else:
+            await route.continue_()
+    
     async def _scrape_page_with_js(self, url: str) -> Optional[Dict]:
         page = None
         try:
@@ -239,7 +291,7 @@ class AdvancedPlaywrightScraper:
                     # Navigate to page
                     response = await page.goto(
                         url, 
-                        wait_until='networkidle',  # Wait for network to be idle
+                        wait_until='domcontentloaded',  # Explicit content waits follow below
                         timeout=60000
                     )
                     
@@ -435,7 +487,8 @@ class AdvancedPlaywrightScraper:
                 'links': links,
                 'scraped_at': time.time(),
                 'method': 'playwright_enhanced_spa' if is_spa else 'playwright_javascript',
-                'word_count': len(content.split()) if content else 0,
+                # _clean_content leaves single-space-separated words, so no second split
+                'word_count': content.count(' ') + 1 if content else 0,
                 'is_spa': is_spa
             }
             
@@ -476,12 +529,7 @@ class AdvancedPlaywrightScraper:
         for line in lines:
             line = line.strip()
             # Skip very short lines and common UI text
-            if len(line) > 5 and not any(skip in line.lower() for skip in [
-                'loading', 'please wait', 'skip to', 'menu', 'search',
-                'cookie', 'privacy policy', 'terms of service',
-                'subscribe', 'sign up', 'login', 'log in',
-                'javascript', 'enable cookies', 'browser support'
-            ]):
+            if len(line) > 5 and not _SKIP_LINE_RE.search(line.lower()):
                 cleaned_lines.append(line)
         
         # Join and clean
@@ -497,8 +545,12 @@ class AdvancedPlaywrightScraper:
     def _extract_urls_enhanced(self, links: List[Dict], base_url: str, 
                              include_patterns: List[str], exclude_patterns: List[str]) -> List[str]:
         """Extract URLs from JavaScript-rendered links"""
-        base_domain = urlparse(base_url).netloc
+        base_parsed = urlparse(base_url)
+        base_domain = base_parsed.netloc
+        include_re = _substring_matcher(tuple(include_patterns))
+        exclude_re = _substring_matcher(tuple(exclude_patterns))
         valid_urls = []
+        seen = {base_url}
         
         for link in links:
             try:
@@ -512,7 +564,7 @@ class AdvancedPlaywrightScraper:
                 
                 # Convert to absolute URL
                 if href.startswith('/'):
-                    full_url = f"{urlparse(base_url).scheme}://{base_domain}{href}"
+                    full_url = f"{base_parsed.scheme}://{base_domain}{href}"
                 elif href.startswith('#'):
                     continue  # Skip anchor links
                 elif href.startswith('http'):
@@ -526,17 +578,18 @@ class AdvancedPlaywrightScraper:
                 if parsed_url.netloc != base_domain:
                     continue
                 
-                # Apply filters
-                if include_patterns and not any(pattern.lower() in full_url.lower() for pattern in include_patterns):
+                # Apply filters (one regex scan each instead of one substring scan per pattern)
+                if include_re is not None and not include_re.search(full_url):
                     continue
                 
-                if exclude_patterns and any(pattern.lower() in full_url.lower() for pattern in exclude_patterns):
+                if exclude_re is not None and exclude_re.search(full_url):
                     continue
                 
                 # Clean URL
                 clean_url = f"{parsed_url.scheme}://{parsed_url.netloc}{parsed_url.path}"
                 
-                if clean_url not in valid_urls and clean_url != base_url:
+                if clean_url not in seen:
+                    seen.add(clean_url)
                     valid_urls.append(clean_url)
                     
             except Exception as e:
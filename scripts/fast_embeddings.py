@@ -1,50 +1,235 @@
 # fast_embeddings.py - Ultra Fast Sentence Transformers Implementation
 import os
+import re
+import asyncio
+import threading
 import json
+import math
+import hashlib
 import time
 import numpy as np
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Union
 from datetime import datetime
 import logging
 
 # Fast sentence transformers
+import torch
 from sentence_transformers import SentenceTransformer
 import faiss  # Ultra fast similarity search
 
+# Optional imports (graceful degradation)
+try:
+    import xxhash  # fast non-cryptographic hashing for chunk dedup
+except Exception:  # pragma: no cover
+    xxhash = None
+
+try:
+    import orjson  # faster JSON for the cache sidecar
+except Exception:  # pragma: no cover
+    orjson = None
+
 logger = logging.getLogger(__name__)
 
+# Inference backend: "onnx" runs the model on ONNX Runtime (sentence-transformers>=3.2);
+# point FAST_EMBED_ONNX_FILE at e.g. onnx/model_qint8_avx512_vnni.onnx for int8 weights
+EMBED_BACKEND = os.getenv("FAST_EMBED_BACKEND", "torch").lower()
+ONNX_FILE = os.getenv("FAST_EMBED_ONNX_FILE")
+# Or set FAST_EMBED_ONNX_QUANTIZE (e.g. "avx512_vnni", "avx2") to export a dynamic int8
+# copy once into FAST_EMBED_ONNX_DIR and load it from there on later starts
+ONNX_QUANTIZE = os.getenv("FAST_EMBED_ONNX_QUANTIZE")
+ONNX_EXPORT_DIR = os.getenv("FAST_EMBED_ONNX_DIR", "onnx-int8")
+
+# Cap intra-op threads to avoid oversubscription on many-core hosts
+TORCH_THREADS = min(8, os.cpu_count() or 1)
+# Reduced-precision weights: "bfloat16" (bf16-capable CPUs) or "float16" (CUDA only);
+# anything else keeps float32. Pooling and normalization always run in float32.
+EMBED_DTYPE = os.getenv("FAST_EMBED_DTYPE", "float32").lower()
+# Opt-in torch.compile of the transformer (PyTorch 2.x only)
+TORCH_COMPILE = os.getenv("FAST_EMBED_COMPILE", "").lower() in ("1", "true", "yes")
+
+# Bulk ingestion above this many texts encodes on one worker process per core
+MULTI_PROCESS_MIN_TEXTS = 1000
+
+# Switch from brute-force scan to an HNSW graph once the corpus is large enough;
+# efSearch trades recall for latency at query time (floor, scaled up with k)
+HNSW_MIN_VECTORS = int(os.getenv("FAST_HNSW_MIN_VECTORS", "5000"))
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+HNSW_MIN_EF_SEARCH = int(os.getenv("FAST_HNSW_EF_SEARCH", "64"))
+
+# Large-corpus index type: "hnsw" (graph), "ivf" (inverted lists, multi-threaded
+# train/search) or "ivfpq" (inverted lists over PQ codes: 48 bytes per vector)
+LARGE_INDEX_TYPE = os.getenv("FAST_INDEX_TYPE", "hnsw").lower()
+IVF_MIN_NLIST = 16
+IVF_NPROBE = 8
+
+# PQ needs enough training rows per centroid; smaller corpora use the other indexes
+IVFPQ_MIN_VECTORS = 10_000
+IVFPQ_M = 48  # sub-quantizers; must divide the embedding dimension (384)
+IVFPQ_NBITS = 8
+IVFPQ_NPROBE = 16
+IVFPQ_TRAIN_SAMPLE = 100_000
+
+# Brute-force index codes: "fp16" (default) or "int8" (per-dim trained min/max,
+# a quarter of float32 memory; query vectors stay float32)
+FLAT_QUANTIZER = os.getenv("FAST_FLAT_QUANTIZER", "fp16").lower()
+
+faiss.omp_set_num_threads(os.cpu_count() or 1)
+
+# Chunking: greedily pack whole sentences up to this many characters
+CHUNK_CHARS = 800  # Optimal for sentence transformers
+_SENTENCE_BREAK_RE = re.compile(r'(?<=[.!?])\s+')
+
+# Chunk storage is column-oriented (one list per field) instead of a dict per chunk
+CHUNK_COLUMNS = ('texts', 'source_urls', 'titles', 'chunk_indices', 'scraped_at')
+
+
+def _empty_columns() -> Dict[str, List]:
+    return {name: [] for name in CHUNK_COLUMNS}
+
+
+def _text_key(text: str):
+    """Hash key used to spot duplicate chunk texts"""
+    if xxhash is not None:
+        return xxhash.xxh64_intdigest(text)
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest()
+
+
+def _dedupe_columns(columns: Dict[str, List]) -> Dict[str, List]:
+    """Keep the first occurrence of each chunk text (repeated nav/footer boilerplate)"""
+    seen = set()
+    keep = []
+    for i, text in enumerate(columns['texts']):
+        key = _text_key(text)
+        if key not in seen:
+            seen.add(key)
+            keep.append(i)
+    if len(keep) == len(columns['texts']):
+        return columns
+    return {name: [values[i] for i in keep] for name, values in columns.items()}
+
 class FastSentenceTransformerStore:
     def __init__(self, model_name: str = "sentence-transformers/all-MiniLM-L6-v2"):
         """Initialize with fastest sentence transformer model"""
         self.model_name = model_name
         self.model = None
         self.embeddings = None
-        self.chunks = []
+        self.columns = _empty_columns()  # chunk text + metadata, one list per field
         self.index = None  # FAISS index for ultra-fast search
         self.dimension = 384  # all-MiniLM-L6-v2 dimension
         self.ready = False
+        self._ready_checked = False  # disk cache probed once, not on every query
+        self._load_lock = threading.Lock()  # searches run on worker threads
+        self._swap_lock = threading.Lock()  # index and columns are replaced/read as a pair
+        # Worker pools pickle the model; ONNX sessions, compiled modules and the
+        # bf16/fp16 upcast hook can't be, so those setups always encode in-process
+        self._multi_process_ok = False
         self.last_updated = None
         
         # Speed optimizations
-        self.batch_size = 32  # Process in batches for speed
+        self.batch_size = 64  # Length-sorted batches keep padding waste low
         self.cache_file = "embeddings_cache.json"
         self.faiss_index_file = "faiss_index.bin"
+        self.embeddings_file = "embeddings.npy"  # float16 matrix, memory-mapped on load
         
     def _load_model(self):
         """Load sentence transformer model with optimizations"""
-        if self.model is None:
+        if self.model is not None:
+            return
+        with self._load_lock:
+            if self.model is not None:
+                return
             logger.info(f"Loading fast model: {self.model_name}")
             start_time = time.time()
             
-            # Load with optimizations
-            self.model = SentenceTransformer(self.model_name)
+            model = self._load_onnx_model() if EMBED_BACKEND == "onnx" else None
+            multi_process_ok = False
+            
+            if model is None:
+                # Load with optimizations
+                model = SentenceTransformer(self.model_name)
+                
+                # CPU optimizations
+                torch.set_num_threads(TORCH_THREADS)
+                model.eval()  # Set to evaluation mode
+                cast = self._cast_model(model)
+                if TORCH_COMPILE:
+                    self._compile_model(model)
+                multi_process_ok = not (cast or TORCH_COMPILE)
+            
+            # Warm the tokenizer and model so the first real query pays no init cost
+            with torch.inference_mode():
+                model.encode(["warmup"], show_progress_bar=False)
             
-            # CPU optimizations
-            self.model.eval()  # Set to evaluation mode
+            # Published only once ready, so other threads never see a half-built model
+            self._multi_process_ok = multi_process_ok
+            self.model = model
             
             load_time = time.time() - start_time
             logger.info(f"✅ Model loaded in {load_time:.2f}s")
     
+    def _cast_model(self, model: SentenceTransformer) -> bool:
+        """Cast transformer weights to EMBED_DTYPE, upcasting token embeddings before pooling"""
+        if EMBED_DTYPE == "bfloat16":
+            dtype = torch.bfloat16
+        elif EMBED_DTYPE == "float16" and model.device.type == "cuda":
+            dtype = torch.float16
+        else:
+            return False
+        
+        transformer = model[0]
+        transformer.to(dtype)
+        
+        # Mean pooling + L2 normalization accumulate in float32 to avoid rounding drift
+        def _upcast(module, inputs, features):
+            features['token_embeddings'] = features['token_embeddings'].float()
+            return features
+        
+        transformer.register_forward_hook(_upcast)
+        logger.info(f"⚡ Transformer weights cast to {dtype}")
+        return True
+    
+    def _compile_model(self, model: SentenceTransformer):
+        """torch.compile the underlying transformer; keep eager mode if unsupported"""
+        try:
+            transformer = model[0]
+            transformer.auto_model = torch.compile(transformer.auto_model, mode="reduce-overhead")
+            logger.info("⚡ Transformer compiled with torch.compile")
+        except Exception as e:
+            logger.warning(f"⚠️ torch.compile unavailable, using eager mode: {e}")
+    
+    def _load_onnx_model(self) -> Optional[SentenceTransformer]:
+        """Load the model on ONNX Runtime's CPU provider; None if unavailable"""
+        try:
+            model_kwargs = {"provider": "CPUExecutionProvider"}
+            if ONNX_QUANTIZE and not ONNX_FILE:
+                return self._load_quantized_onnx_model(model_kwargs)
+            if ONNX_FILE:
+                model_kwargs["file_name"] = ONNX_FILE
+            model = SentenceTransformer(self.model_name, backend="onnx", model_kwargs=model_kwargs)
+            logger.info(f"⚡ Using ONNX Runtime backend ({ONNX_FILE or 'model.onnx'})")
+            return model
+        except Exception as e:
+            logger.warning(f"⚠️ ONNX backend unavailable, falling back to PyTorch: {e}")
+            return None
+    
+    def _load_quantized_onnx_model(self, model_kwargs: Dict) -> SentenceTransformer:
+        """Load the dynamic int8 ONNX export, creating it on first use"""
+        suffix = f"qint8_{ONNX_QUANTIZE}"
+        file_name = f"onnx/model_{suffix}.onnx"
+        if not os.path.exists(os.path.join(ONNX_EXPORT_DIR, file_name)):
+            from sentence_transformers import export_dynamic_quantized_onnx_model
+            logger.info(f"🔧 Exporting int8 ONNX model ({ONNX_QUANTIZE}) to {ONNX_EXPORT_DIR}")
+            model = SentenceTransformer(self.model_name, backend="onnx", model_kwargs=model_kwargs)
+            model.save(ONNX_EXPORT_DIR)
+            export_dynamic_quantized_onnx_model(model, ONNX_QUANTIZE, ONNX_EXPORT_DIR, file_suffix=suffix)
+        
+        model = SentenceTransformer(
+            ONNX_EXPORT_DIR, backend="onnx", model_kwargs={**model_kwargs, "file_name": file_name}
+        )
+        logger.info(f"⚡ Using ONNX Runtime backend ({ONNX_EXPORT_DIR}/{file_name})")
+        return model
+    
     async def process_pages(self, pages: List[Dict]):
         """FAST processing with sentence transformers + FAISS"""
         logger.info(f"🚀 Fast Sentence Transformer processing for {len(pages)} pages...")
@@ -56,12 +241,13 @@ class FastSentenceTransformerStore:
         # Step 1: Create chunks (same as before)
         logger.info("📝 Step 1: Creating chunks...")
         chunks_start = time.time()
-        all_chunks = []
+        columns = _empty_columns()
         
         for i, page in enumerate(pages):
             try:
-                chunks = self._create_chunks(page)
-                all_chunks.extend(chunks)
+                page_columns = self._create_chunks(page)
+                for name in CHUNK_COLUMNS:
+                    columns[name].extend(page_columns[name])
                 if (i + 1) % 5 == 0:
                     logger.info(f"   📄 Processed {i+1}/{len(pages)} pages")
             except Exception as e:
@@ -69,9 +255,12 @@ class FastSentenceTransformerStore:
                 continue
         
         chunks_time = time.time() - chunks_start
-        logger.info(f"✅ Created {len(all_chunks)} chunks in {chunks_time:.2f}s")
+        created = len(columns['texts'])
+        columns = _dedupe_columns(columns)
+        texts = columns['texts']
+        logger.info(f"✅ Created {created} chunks in {chunks_time:.2f}s ({created - len(texts)} duplicates dropped)")
         
-        if not all_chunks:
+        if not texts:
             logger.error("❌ No chunks created!")
             return
         
@@ -79,9 +268,6 @@ class FastSentenceTransformerStore:
         logger.info("🧠 Step 2: Generating sentence embeddings...")
         embeddings_start = time.time()
         
-        # Extract texts for embedding
-        texts = [chunk['text'] for chunk in all_chunks]
-        
         # Generate embeddings in optimized batches
         embeddings = self._generate_embeddings_fast(texts)
         
@@ -93,23 +279,17 @@ class FastSentenceTransformerStore:
         logger.info("🔍 Step 3: Building FAISS index...")
         faiss_start = time.time()
         
-        # Convert to numpy array
-        embeddings_array = np.array(embeddings).astype('float32')
-        
-        # Create FAISS index (ultra fast)
-        self.index = faiss.IndexFlatIP(self.dimension)  # Inner Product (cosine with normalized vectors)
-        
-        # Normalize embeddings for cosine similarity
-        faiss.normalize_L2(embeddings_array)
-        
-        # Add to index
-        self.index.add(embeddings_array)
+        # Rows are already unit-length (encode(normalize_embeddings=True) on every
+        # path), so inner product is cosine without another normalization pass
+        index = self._build_index(embeddings)
         
         faiss_time = time.time() - faiss_start
         logger.info(f"✅ FAISS index built in {faiss_time:.2f}s")
         
-        # Store data
-        self.chunks = all_chunks
+        # Store data; concurrent searches see either the old pair or the new one
+        with self._swap_lock:
+            self.index = index
+            self.columns = columns
         self.embeddings = embeddings
         self.ready = True
         self.last_updated = datetime.now().isoformat()
@@ -119,163 +299,288 @@ class FastSentenceTransformerStore:
         
         total_time = time.time() - total_start
         logger.info(f"🎉 COMPLETE! Total processing time: {total_time:.2f}s")
-        logger.info(f"📊 Ready for ultra-fast semantic search: {len(self.chunks)} chunks")
+        logger.info(f"📊 Ready for ultra-fast semantic search: {self.get_total_chunks()} chunks")
+    
+    def _build_index(self, embeddings_array: np.ndarray):
+        """Build the search index over L2-normalized float32 vectors"""
+        if len(embeddings_array) >= IVFPQ_MIN_VECTORS and LARGE_INDEX_TYPE == "ivfpq":
+            # Compressed codes (~32x smaller than float32 rows); 4*sqrt(N) lists
+            nlist = max(IVF_MIN_NLIST, int(4 * math.sqrt(len(embeddings_array))))
+            quantizer = faiss.IndexFlatIP(self.dimension)
+            index = faiss.IndexIVFPQ(
+                quantizer, self.dimension, nlist, IVFPQ_M, IVFPQ_NBITS, faiss.METRIC_INNER_PRODUCT
+            )
+            index.train(self._training_sample(embeddings_array))
+            index.add(embeddings_array)
+            index.nprobe = IVFPQ_NPROBE
+            return index
+        
+        if len(embeddings_array) >= HNSW_MIN_VECTORS and LARGE_INDEX_TYPE == "ivf":
+            # Coarse-quantized inverted lists; probes only nprobe of sqrt(N) clusters
+            nlist = max(IVF_MIN_NLIST, int(math.sqrt(len(embeddings_array))))
+            quantizer = faiss.IndexFlatIP(self.dimension)
+            index = faiss.IndexIVFFlat(quantizer, self.dimension, nlist, faiss.METRIC_INNER_PRODUCT)
+            index.train(embeddings_array)
+            index.add(embeddings_array)
+            index.nprobe = IVF_NPROBE
+            return index
+        
+        if len(embeddings_array) >= HNSW_MIN_VECTORS:
+            # Sub-linear graph search for large corpora
+            index = faiss.IndexHNSWFlat(self.dimension, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+            index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+            index.add(embeddings_array)
+            return index
+        
+        # fp16 scalar quantizer: half the memory/bandwidth of IndexFlatIP for the
+        # memory-bound brute-force scan, with negligible recall loss on MiniLM vectors;
+        # QT_8bit halves it again, training the per-dimension ranges on the corpus
+        qtype = faiss.ScalarQuantizer.QT_8bit if FLAT_QUANTIZER == "int8" else faiss.ScalarQuantizer.QT_fp16
+        index = faiss.IndexScalarQuantizer(self.dimension, qtype, faiss.METRIC_INNER_PRODUCT)
+        index.train(self._training_sample(embeddings_array))
+        index.add(embeddings_array)
+        return index
+    
+    @staticmethod
+    def _training_sample(embeddings_array: np.ndarray) -> np.ndarray:
+        """Random subset of rows for training quantizers on very large corpora"""
+        if len(embeddings_array) <= IVFPQ_TRAIN_SAMPLE:
+            return embeddings_array
+        rows = np.random.default_rng(0).choice(len(embeddings_array), IVFPQ_TRAIN_SAMPLE, replace=False)
+        return np.ascontiguousarray(embeddings_array[np.sort(rows)], dtype=np.float32)
     
-    def _generate_embeddings_fast(self, texts: List[str]) -> List[List[float]]:
+    def _generate_embeddings_fast(self, texts: List[str]) -> np.ndarray:
         """Generate embeddings with speed optimizations"""
         logger.info(f"   🔄 Processing {len(texts)} texts in batches of {self.batch_size}")
         
-        all_embeddings = []
+        workers = os.cpu_count() or 1
+        if len(texts) > MULTI_PROCESS_MIN_TEXTS and workers > 1 and self._multi_process_ok:
+            return self._generate_embeddings_multi_process(texts, workers)
         
-        # Process in batches for speed
-        for i in range(0, len(texts), self.batch_size):
-            batch = texts[i:i + self.batch_size]
-            
-            # Generate embeddings for batch
-            batch_embeddings = self.model.encode(
-                batch,
+        # One encode call for the whole ingestion: sentence-transformers sorts by
+        # length internally so each batch pads to similar lengths, and the tokenizer
+        # and per-call setup are paid once instead of once per batch
+        with torch.inference_mode():
+            embeddings = self.model.encode(
+                texts,
                 batch_size=self.batch_size,
                 show_progress_bar=False,
                 convert_to_numpy=True,
                 normalize_embeddings=True  # For cosine similarity
             )
-            
-            all_embeddings.extend(batch_embeddings.tolist())
-            
-            if (i + self.batch_size) % 100 == 0:
-                logger.info(f"   ⚡ Processed {min(i + self.batch_size, len(texts))}/{len(texts)} texts")
         
-        return all_embeddings
+        return np.ascontiguousarray(embeddings, dtype=np.float32)
     
-    async def search_similar(self, query: str, max_results: int = 5) -> List[Dict]:
-        """ULTRA FAST semantic search using FAISS"""
-        if not self.ready:
-            self._load_from_disk()
+    def _generate_embeddings_multi_process(self, texts: List[str], workers: int) -> np.ndarray:
+        """Encode a large ingestion batch on one CPU worker process per core"""
+        logger.info(f"   🧵 Encoding on {workers} worker processes")
+        pool = self.model.start_multi_process_pool(target_devices=['cpu'] * workers)
+        try:
+            embeddings = self.model.encode_multi_process(
+                texts, pool, batch_size=self.batch_size, normalize_embeddings=True
+            )
+        finally:
+            self.model.stop_multi_process_pool(pool)
+        return np.ascontiguousarray(embeddings, dtype=np.float32)
+    
+    async def search_similar(self, query: Union[str, List[str]], max_results: int = 5) -> Union[List[Dict], List[List[Dict]]]:
+        """ULTRA FAST semantic search using FAISS, run on a worker thread
+        
+        Encoding and FAISS search are CPU-bound (both release the GIL), so they
+        run off the event loop. See `search` for the arguments.
+        """
+        return await asyncio.to_thread(self.search, query, max_results)
+    
+    def search(self, query: Union[str, List[str]], max_results: int = 5) -> Union[List[Dict], List[List[Dict]]]:
+        """Blocking FAISS search
+        
+        Accepts one query or a list of queries; a list is encoded and searched as
+        one batch and returns one result list per query.
+        """
+        single = isinstance(query, str)
+        queries = [query] if single else list(query)
+        empty = [] if single else [[] for _ in queries]
         
-        if not self.ready or self.index is None:
+        if not self.ready and not self._ready_checked:
+            with self._load_lock:
+                if not self._ready_checked:
+                    self._load_from_disk()
+        
+        with self._swap_lock:
+            index, columns = self.index, self.columns
+        
+        if not self.ready or index is None:
             logger.error("❌ Search index not ready!")
-            return []
+            return empty
+        
+        if not queries:
+            return empty
         
         try:
-            # Generate query embedding
+            # Generate query embeddings in one batch
             self._load_model()
-            query_embedding = self.model.encode(
-                [query], 
-                normalize_embeddings=True,
-                convert_to_numpy=True
-            )
+            with torch.inference_mode():
+                query_embeddings = np.ascontiguousarray(self.model.encode(
+                    queries, 
+                    normalize_embeddings=True,
+                    convert_to_numpy=True
+                ), dtype=np.float32)
             
-            # FAISS search (ultra fast!)
+            # Per-call efSearch: the index is shared by concurrent searches on worker threads
+            params = None
+            if isinstance(index, faiss.IndexHNSWFlat):
+                params = faiss.SearchParametersHNSW(efSearch=max(HNSW_MIN_EF_SEARCH, max_results * 8))
+            
+            # FAISS batch search (ultra fast!)
             search_start = time.time()
-            scores, indices = self.index.search(query_embedding, max_results)
+            scores, indices = index.search(query_embeddings, max_results, params=params)
             search_time = time.time() - search_start
             
-            logger.info(f"🔍 FAISS search completed in {search_time*1000:.1f}ms")
+            logger.info(f"🔍 FAISS search of {len(queries)} quer{'y' if len(queries) == 1 else 'ies'} completed in {search_time*1000:.1f}ms")
             
             # Format results
-            results = []
-            for score, idx in zip(scores[0], indices[0]):
-                if idx < len(self.chunks):  # Valid index
-                    results.append({
-                        'text': self.chunks[idx]['text'],
-                        'metadata': self.chunks[idx]['metadata'],
-                        'score': float(score)  # Cosine similarity score
-                    })
+            total = len(columns['texts'])
+            all_results = []
+            for row_scores, row_indices in zip(scores, indices):
+                results = []
+                for score, idx in zip(row_scores, row_indices):
+                    if 0 <= idx < total:  # Valid index (FAISS pads with -1)
+                        results.append(self._chunk_result(columns, idx, float(score)))
+                all_results.append(results)
             
-            return results
+            return all_results[0] if single else all_results
             
         except Exception as e:
             logger.error(f"Error in semantic search: {e}")
-            return []
+            return empty
+    
+    @staticmethod
+    def _chunk_result(columns: Dict[str, List], idx: int, score: float) -> Dict:
+        """Build the result dict for one chunk on demand"""
+        return {
+            'text': columns['texts'][idx],
+            'metadata': {
+                'source_url': columns['source_urls'][idx],
+                'title': columns['titles'][idx],
+                'chunk_index': columns['chunk_indices'][idx],
+                'scraped_at': columns['scraped_at'][idx]
+            },
+            'score': score  # Cosine similarity score
+        }
     
-    def _create_chunks(self, page: Dict) -> List[Dict]:
-        """Create chunks from page content (same as before)"""
+    def _create_chunks(self, page: Dict) -> Dict[str, List]:
+        """Create chunks from page content, returned as columns"""
         try:
             content = page.get('content', '')
             if not content or len(content) < 100:
-                return []
+                return _empty_columns()
             
-            # Sentence-based chunking for better semantic coherence
-            sentences = [s.strip() for s in content.split('.') if s.strip()]
+            # Sentence-based chunking for better semantic coherence: pack sentence
+            # boundary offsets, then slice the content once per chunk
+            ends = [m.end() for m in _SENTENCE_BREAK_RE.finditer(content)]
+            ends.append(len(content))
             
-            chunks = []
-            current_chunk = ""
+            spans = []
+            chunk_start = prev_end = 0
+            for end in ends:
+                if end - chunk_start > CHUNK_CHARS and prev_end > chunk_start:
+                    spans.append((chunk_start, prev_end))
+                    chunk_start = prev_end
+                prev_end = end
+            spans.append((chunk_start, len(content)))
             
-            for sentence in sentences:
-                # If adding this sentence would make chunk too long, save current chunk
-                if len(current_chunk) + len(sentence) > 800:  # Optimal for sentence transformers
-                    if current_chunk:
-                        chunks.append({
-                            'text': current_chunk.strip(),
-                            'metadata': {
-                                'source_url': page.get('url', ''),
-                                'title': page.get('title', ''),
-                                'chunk_index': len(chunks),
-                                'scraped_at': page.get('scraped_at', '')
-                            }
-                        })
-                    current_chunk = sentence
-                else:
-                    current_chunk += ". " + sentence
+            texts = [t for t in (content[start:stop].strip() for start, stop in spans) if t]
             
-            # Add final chunk
-            if current_chunk.strip():
-                chunks.append({
-                    'text': current_chunk.strip(),
-                    'metadata': {
-                        'source_url': page.get('url', ''),
-                        'title': page.get('title', ''),
-                        'chunk_index': len(chunks),
-                        'scraped_at': page.get('scraped_at', '')
-                    }
-                })
-            
-            return chunks
+            # Page-level metadata is shared by all of the page's chunks
+            n = len(texts)
+            return {
+                'texts': texts,
+                'source_urls': [page.get('url', '')] * n,
+                'titles': [page.get('title', '')] * n,
+                'chunk_indices': list(range(n)),
+                'scraped_at': [page.get('scraped_at', '')] * n
+            }
             
         except Exception as e:
             logger.error(f"Error creating chunks: {e}")
-            return []
+            return _empty_columns()
     
     def _save_to_disk(self):
         """Save embeddings and index to disk for fast loading"""
         try:
-            # Save chunks and metadata
+            # Save chunks and metadata (embeddings go to a binary sidecar)
             data = {
-                'chunks': self.chunks,
-                'embeddings': self.embeddings,
+                'columns': self.columns,
                 'last_updated': self.last_updated,
                 'ready': self.ready,
                 'model_name': self.model_name
             }
             
-            with open(self.cache_file, 'w') as f:
-                json.dump(data, f)
+            if orjson is not None:
+                with open(self.cache_file, 'wb') as f:
+                    f.write(orjson.dumps(data, option=orjson.OPT_SERIALIZE_NUMPY))
+            else:
+                with open(self.cache_file, 'w') as f:
+                    json.dump(data, f)
+            
+            # Save embeddings as float16 (half the disk of float32; upcast with
+            # .astype(np.float32) before feeding them back into FAISS)
+            if self.embeddings is not None:
+                np.save(self.embeddings_file, np.asarray(self.embeddings, dtype=np.float16))
             
             # Save FAISS index
             if self.index:
                 faiss.write_index(self.index, self.faiss_index_file)
             
-            logger.info(f"💾 Saved {len(self.chunks)} chunks and FAISS index to disk")
+            logger.info(f"💾 Saved {self.get_total_chunks()} chunks and FAISS index to disk")
             
         except Exception as e:
             logger.error(f"Error saving to disk: {e}")
     
     def _load_from_disk(self):
         """Load embeddings and index from disk for instant startup"""
+        self._ready_checked = True
         try:
             # Load chunks and metadata
-            with open(self.cache_file, 'r') as f:
-                data = json.load(f)
-                self.chunks = data.get('chunks', [])
-                self.embeddings = data.get('embeddings', [])
-                self.last_updated = data.get('last_updated')
-                self.ready = data.get('ready', False)
+            with open(self.cache_file, 'rb') as f:
+                raw = f.read()
+            data = orjson.loads(raw) if orjson is not None else json.loads(raw)
+            if 'columns' in data:
+                columns = data['columns']
+            else:
+                columns = self._columns_from_chunks(data.get('chunks', []))
+            self.last_updated = data.get('last_updated')
+            
+            # Memory-map embeddings; pages are read lazily (only needed for index rebuilds)
+            if os.path.exists(self.embeddings_file):
+                try:
+                    self.embeddings = np.load(self.embeddings_file, mmap_mode='r')
+                except (OSError, ValueError) as e:
+                    logger.warning(f"⚠️ mmap failed for {self.embeddings_file}, loading into memory: {e}")
+                    self.embeddings = np.load(self.embeddings_file)
+            elif 'embeddings' in data:
+                # Older caches stored embeddings inline in the JSON file
+                self.embeddings = np.asarray(data['embeddings'], dtype=np.float32)
             
-            # Load FAISS index
+            # Load FAISS index read-only; FAISS memory-maps only IVF/IVF-PQ inverted lists,
+            # so those stay in the OS page cache while flat-SQ/HNSW indexes load into RAM
+            # (indexes are rebuilt, never appended to, on the next process_pages)
+            index = None
             if os.path.exists(self.faiss_index_file):
-                self.index = faiss.read_index(self.faiss_index_file)
+                try:
+                    index = faiss.read_index(
+                        self.faiss_index_file, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+                    )
+                except RuntimeError as e:
+                    logger.warning(f"⚠️ mmap failed for {self.faiss_index_file}, loading into memory: {e}")
+                    index = faiss.read_index(self.faiss_index_file)
             
-            logger.info(f"📁 Loaded {len(self.chunks)} chunks and FAISS index from disk")
+            with self._swap_lock:
+                self.index = index
+                self.columns = columns
+            self.ready = data.get('ready', False)
+            
+            logger.info(f"📁 Loaded {self.get_total_chunks()} chunks and FAISS index from disk")
             
         except FileNotFoundError:
             logger.info("📁 No existing cache found")
@@ -283,18 +588,31 @@ class FastSentenceTransformerStore:
             logger.error(f"Error loading from disk: {e}")
     
     def is_ready(self) -> bool:
-        if not self.ready:
+        if not self.ready and not self._ready_checked:
             self._load_from_disk()
-        return self.ready and len(self.chunks) > 0
+        return self.ready and self.get_total_chunks() > 0
     
     def get_total_chunks(self) -> int:
-        return len(self.chunks)
+        return len(self.columns['texts'])
+    
+    @staticmethod
+    def _columns_from_chunks(chunks: List[Dict]) -> Dict[str, List]:
+        """Convert an older per-chunk dict cache into columns"""
+        columns = _empty_columns()
+        for chunk in chunks:
+            metadata = chunk.get('metadata', {})
+            columns['texts'].append(chunk.get('text', ''))
+            columns['source_urls'].append(metadata.get('source_url', ''))
+            columns['titles'].append(metadata.get('title', ''))
+            columns['chunk_indices'].append(metadata.get('chunk_index', 0))
+            columns['scraped_at'].append(metadata.get('scraped_at', ''))
+        return columns
 
 
 # Updated requirements.txt additions:
 """
 Add these to requirements.txt:
-sentence-transformers==2.2.2
+sentence-transformers==2.2.2  (>=3.2 plus onnxruntime for FAST_EMBED_BACKEND=onnx)
 faiss-cpu==1.7.4
 numpy==1.24.3
 """
\ No newline at end of file
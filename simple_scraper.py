@@ -1,10 +1,12 @@
 import asyncio
 import logging
+import os
 import random
 import time
 import hashlib
 import io
-from typing import List, Dict, Optional, Callable, Any, Set, Tuple
+from contextlib import asynccontextmanager
+from typing import List, Dict, Optional, Callable, Any, Set, Tuple, AsyncIterator
 from urllib.parse import urlparse, urlunparse, urljoin, parse_qsl, urlencode
 
 import re
@@ -26,6 +28,16 @@ try:
 except Exception:  # pragma: no cover
     httpx = None
 
+try:
+    import hishel  # optional on-disk HTTP cache for static fetches
+except Exception:  # pragma: no cover
+    hishel = None
+
+try:
+    from selectolax.parser import HTMLParser  # C HTML parser for title/meta/text extraction
+except Exception:  # pragma: no cover
+    HTMLParser = None
+
 from playwright.async_api import async_playwright, Browser, BrowserContext, Page
 import urllib.robotparser as robotparser
 
@@ -49,6 +61,63 @@ def content_hash(text: str) -> str:
     return hashlib.sha256(text.encode("utf-8", errors="ignore")).hexdigest()
 
 
+def parse_html_meta(html: str, url: str) -> Tuple[Optional[str], Optional[str], Dict[str, str]]:
+    """Return (title, meta description, og/canonical meta) from an HTML document"""
+    title = meta_desc = og_title = og_desc = canonical = None
+
+    if HTMLParser is not None:
+        tree = HTMLParser(html)
+        node = tree.css_first("title")
+        title = (node.text(strip=True) or None) if node else None
+        for m in tree.css("meta"):
+            attrs = m.attributes
+            content = (attrs.get("content") or "").strip()
+            if not content:
+                continue
+            if (attrs.get("name") or "").lower() == "description":
+                meta_desc = content
+            prop = attrs.get("property")
+            if prop == "og:title":
+                og_title = content
+            elif prop == "og:description":
+                og_desc = content
+        for link in tree.css("link[rel]"):
+            href = link.attributes.get("href")
+            if href and "canonical" in (link.attributes.get("rel") or "").lower():
+                canonical = urljoin(url, href.strip())
+                break
+    else:
+        soup = BeautifulSoup(html, "lxml")
+        title = soup.title.string.strip() if soup.title and soup.title.string else None
+        for m in soup.find_all("meta"):
+            if m.get("name", "").lower() == "description" and m.get("content"):
+                meta_desc = m["content"].strip()
+            if m.get("property") == "og:title" and m.get("content"):
+                og_title = m["content"].strip()
+            if m.get("property") == "og:description" and m.get("content"):
+                og_desc = m["content"].strip()
+        link_canon = soup.find("link", rel=lambda v: v and "canonical" in v.lower())
+        if link_canon and link_canon.get("href"):
+            canonical = urljoin(url, link_canon["href"].strip())
+
+    meta = {
+        "og:title": og_title or "",
+        "og:description": og_desc or "",
+        "canonical": canonical or "",
+    }
+    return title, meta_desc, meta
+
+
+def html_to_text(html: str) -> str:
+    """Visible text of an HTML document, space-separated"""
+    if HTMLParser is not None:
+        tree = HTMLParser(html)
+        tree.strip_tags(["script", "style", "noscript", "template"])
+        root = tree.body or tree.root
+        return root.text(separator=" ", strip=True) if root else ""
+    return BeautifulSoup(html, "lxml").get_text(separator=" ", strip=True)
+
+
 def is_probably_pdf(url: str, headers: Optional[Dict[str, str]] = None) -> bool:
     if url.lower().endswith(".pdf"):
         return True
@@ -58,6 +127,17 @@ def is_probably_pdf(url: str, headers: Optional[Dict[str, str]] = None) -> bool:
     return False
 
 
+BOT_BLOCK_STATUSES = {403, 429, 503}
+
+
+def is_bot_blocked(status: int, headers) -> bool:
+    """Detect bot-protection responses from status + headers alone (no body needed)."""
+    if status in BOT_BLOCK_STATUSES:
+        return True
+    # Cloudflare marks challenge pages explicitly
+    return "cf-mitigated" in headers
+
+
 def random_user_agent() -> str:
     ua_pool = [
         "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36",
@@ -67,6 +147,51 @@ def random_user_agent() -> str:
     return random.choice(ua_pool)
 
 
+# Boilerplate UI/navigation phrases; one compiled alternation scans a line in a single pass
+_SKIP_LINE_PATTERNS = [
+    'home', 'about', 'contact', 'privacy', 'terms', 'policy',
+    'cookie', 'subscribe', 'newsletter', 'follow us', 'social',
+    'copyright', '©', 'all rights reserved', 'skip to',
+    'menu', 'search', 'login', 'sign up', 'cart', 'checkout',
+    'loading', 'please wait', 'javascript', 'enable', 'browser',
+    'back to top', 'scroll', 'click here', 'read more',
+    'share', 'tweet', 'facebook', 'instagram', 'linkedin'
+]
+_SKIP_LINE_RE = re.compile("|".join(re.escape(p) for p in _SKIP_LINE_PATTERNS))
+
+# Content cleanup patterns, compiled once instead of looked up per page / per line
+_BLANK_LINES_RE = re.compile(r'\n\s*\n')
+_INLINE_SPACE_RE = re.compile(r'[ \t]+')
+_NON_ALPHA_RE = re.compile(r'[^a-zA-Z]')
+_EXTRA_NEWLINES_RE = re.compile(r'\n{3,}')
+
+# Static fetches: only download bodies we can extract text from, and cap their size
+# (PDFs are exempt: pdfminer can't parse a truncated file)
+TEXT_CONTENT_TYPES = ("text/", "html", "xml", "json")
+MAX_STATIC_BYTES = 5 * 1024 * 1024
+
+# Opt-in response cache for static fetches (handy when re-running scrapes while debugging)
+HTTP_CACHE_DIR = os.getenv("SCRAPER_HTTP_CACHE_DIR")
+HTTP_CACHE_TTL = int(os.getenv("SCRAPER_HTTP_CACHE_TTL", "600"))
+
+
+def new_http_client() -> "httpx.AsyncClient":
+    """HTTP/2 client with bounded keep-alive pool, shared by all static fetches of a scraper."""
+    transport = httpx.AsyncHTTPTransport(
+        http2=True,
+        limits=httpx.Limits(max_connections=50, max_keepalive_connections=20, keepalive_expiry=30.0),
+    )
+    if HTTP_CACHE_DIR and hishel is not None:
+        storage = hishel.AsyncFileStorage(base_path=HTTP_CACHE_DIR, ttl=HTTP_CACHE_TTL)
+        transport = hishel.AsyncCacheTransport(transport=transport, storage=storage)
+        logger.info(f"💾 Static fetch cache enabled at {HTTP_CACHE_DIR} (ttl={HTTP_CACHE_TTL}s)")
+    return httpx.AsyncClient(
+        transport=transport,
+        follow_redirects=True,
+        timeout=httpx.Timeout(30.0, connect=5.0),
+    )
+
+
 # ----------------------- Rate limiting & concurrency -----------------------
 
 class HostLimiter:
@@ -91,10 +216,19 @@ class HostLimiter:
 # ----------------------------- Robots manager -----------------------------
 
 class RobotsManager:
-    def __init__(self, user_agent: str = "Mozilla/5.0 (compatible; SimpleScraper/1.0)"):
+    def __init__(self, user_agent: str = "Mozilla/5.0 (compatible; SimpleScraper/1.0)",
+                 http_client: Optional[Callable[[], Any]] = None):
         self.user_agent = user_agent
+        self.http_client = http_client  # returns a shared httpx.AsyncClient
         self.cache: Dict[str, robotparser.RobotFileParser] = {}
 
+    async def _get(self, url: str):
+        headers = {"User-Agent": self.user_agent}
+        if self.http_client:
+            return await self.http_client().get(url, headers=headers, timeout=10)
+        async with httpx.AsyncClient(timeout=10) as client:
+            return await client.get(url, headers=headers)
+
     async def allowed(self, url: str) -> bool:
         parsed = urlparse(url)
         base = f"{parsed.scheme}://{parsed.netloc}"
@@ -105,13 +239,12 @@ class RobotsManager:
             # Fetch robots.txt using httpx if available; otherwise allow by default
             try:
                 if httpx:
-                    async with httpx.AsyncClient(timeout=10) as client:
-                        r = await client.get(robots_url, headers={"User-Agent": self.user_agent})
-                        if r.status_code == 200:
-                            rp.parse(r.text.splitlines())
-                        else:
-                            # If no robots or error, default allow (conservative dev choice: allow)
-                            rp.parse(["User-agent: *", "Allow: /"])
+                    r = await self._get(robots_url)
+                    if r.status_code == 200:
+                        rp.parse(r.text.splitlines())
+                    else:
+                        # If no robots or error, default allow (conservative dev choice: allow)
+                        rp.parse(["User-agent: *", "Allow: /"])
                 else:
                     rp.parse(["User-agent: *", "Allow: /"])
             except Exception:
@@ -200,23 +333,36 @@ class EnhancedSimpleScraper:
                  host_min_interval_ms: int = 200,
                  respect_robots: bool = True,
                  enable_resource_blocking: bool = True,
+                 job_max_concurrent: int = 5,
                  on_result: Optional[Callable[[str, ScrapedPage], Any]] = None):
         self.max_retries = max_retries
+        self.job_max_concurrent = job_max_concurrent  # pages fetched in parallel per job
         self.wait_selector = wait_selector
         self.enable_resource_blocking = enable_resource_blocking
         self.playwright = None
         self.browser: Optional[Browser] = None
         self.host_limiter = HostLimiter(host_max_concurrent, host_min_interval_ms)
-        self.robots = RobotsManager() if respect_robots else None
+        self._http = None  # shared httpx.AsyncClient, created on first static fetch
+        self.robots = RobotsManager(http_client=self._http_client) if respect_robots else None
         self.on_result = on_result  # callback (tenant_id, page)
 
         # Dedup across a run
         self.seen_urls: Set[str] = set()
 
+        # One long-lived browser is shared by every run; runs only get fresh contexts
+        self._browser_lock = asyncio.Lock()
+
     # -------- Playwright lifecycle --------
     async def _ensure_browser(self):
-        if self.playwright and self.browser:
-            return
+        async with self._browser_lock:
+            if self.playwright and self.browser and self.browser.is_connected():
+                return
+            if self.browser or self.playwright:
+                # Browser crashed or was disconnected; start over
+                await self._close_browser()
+            await self._launch_browser()
+
+    async def _launch_browser(self):
         self.playwright = await async_playwright().start()
         self.browser = await self.playwright.chromium.launch(
             headless=True,
@@ -234,13 +380,39 @@ class EnhancedSimpleScraper:
 
     async def _close_browser(self):
         if self.browser:
-            await self.browser.close()
+            try:
+                await self.browser.close()
+            except Exception as e:
+                logger.debug(f"Browser close error: {e}")
             self.browser = None
         if self.playwright:
             await self.playwright.stop()
             self.playwright = None
         logger.info("🛑 Enhanced Playwright browser closed.")
 
+    def _http_client(self) -> "httpx.AsyncClient":
+        if self._http is None or self._http.is_closed:
+            self._http = new_http_client()
+        return self._http
+
+    async def close(self):
+        """Shut down the shared browser and HTTP client (call on application shutdown)"""
+        async with self._browser_lock:
+            await self._close_browser()
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+    @asynccontextmanager
+    async def _context(self) -> AsyncIterator[BrowserContext]:
+        """Yield a fresh isolated context on the shared browser; only the context is closed afterwards"""
+        await self._ensure_browser()
+        ctx = await self._new_context()
+        try:
+            yield ctx
+        finally:
+            await ctx.close()
+
     async def _new_context(self) -> BrowserContext:
         assert self.browser is not None
         context = await self.browser.new_context(
@@ -275,12 +447,9 @@ class EnhancedSimpleScraper:
         returns { tenant_id: [ScrapedPage.dict(), ...] }
         """
         await self._ensure_browser()
-        try:
-            tasks = [self._scrape_job(job) for job in jobs]
-            results = await asyncio.gather(*tasks)
-            return {job["tenant_id"]: pages for job, pages in zip(jobs, results)}
-        finally:
-            await self._close_browser()
+        tasks = [self._scrape_job(job) for job in jobs]
+        results = await asyncio.gather(*tasks)
+        return {job["tenant_id"]: pages for job, pages in zip(jobs, results)}
 
     # -------- Single tenant --------
     async def _scrape_job(self, job: Dict[str, Any]) -> List[Dict[str, Any]]:
@@ -294,36 +463,57 @@ class EnhancedSimpleScraper:
                 unique_urls.append(u)
                 seen.add(u)
 
-        ctx = await self._new_context()
-        page = await ctx.new_page()
-
-        results: List[Dict[str, Any]] = []
-        try:
-            for i, url in enumerate(unique_urls):
-                if url in self.seen_urls:
-                    continue
-                self.seen_urls.add(url)
-
-                # robots.txt
-                if self.robots:
-                    allowed = await self.robots.allowed(url)
-                    if not allowed:
-                        logger.info(f"🤖 Blocked by robots.txt: {url}")
-                        continue
-
+        async def scrape_one(ctx: BrowserContext, pages: asyncio.Queue, i: int, url: str) -> Optional[Dict[str, Any]]:
+            if url in self.seen_urls:
+                return None
+            self.seen_urls.add(url)
+
+            # robots.txt
+            if self.robots:
+                allowed = await self.robots.allowed(url)
+                if not allowed:
+                    logger.info(f"🤖 Blocked by robots.txt: {url}")
+                    return None
+
+            # Borrow a slot from the job's pool; pool size bounds concurrency. A slot
+            # holds a live page or None (not opened yet, or its page died)
+            page = await pages.get()
+            try:
+                if page is None or page.is_closed():
+                    page = await ctx.new_page()
                 logger.info(f"📄 Scraping page {i+1}/{len(unique_urls)} for {tenant_id}: {url}")
                 sp = await self._fetch_with_retries(page, url)
-                if sp:
-                    results.append(sp.to_dict())
-                    # callback for pipeline (e.g., push to Qdrant)
-                    if self.on_result:
-                        try:
-                            self.on_result(tenant_id, sp)
-                        except Exception as cb_err:
-                            logger.warning(f"⚠️ on_result callback error for {url}: {cb_err}")
-        finally:
-            await ctx.close()
+            finally:
+                # Always hand the slot back, even if opening a replacement page failed,
+                # so the pool never shrinks and waiting borrowers can't hang
+                pages.put_nowait(None if page is None or page.is_closed() else page)
+
+            if not sp:
+                return None
+            # callback for pipeline (e.g., push to Qdrant)
+            if self.on_result:
+                try:
+                    self.on_result(tenant_id, sp)
+                except Exception as cb_err:
+                    logger.warning(f"⚠️ on_result callback error for {url}: {cb_err}")
+            return sp.to_dict()
+
+        async with self._context() as ctx:
+            # Reuse K pages across the job instead of opening one per URL (opened on first borrow)
+            pages: asyncio.Queue = asyncio.Queue()
+            for _ in range(min(self.job_max_concurrent, len(unique_urls))):
+                pages.put_nowait(None)
+            scraped = await asyncio.gather(
+                *[scrape_one(ctx, pages, i, url) for i, url in enumerate(unique_urls)],
+                return_exceptions=True
+            )
 
+        results: List[Dict[str, Any]] = []
+        for url, item in zip(unique_urls, scraped):
+            if isinstance(item, Exception):
+                logger.warning(f"⚠️ Scrape failed for {url}: {item}")
+            elif item:
+                results.append(item)
         return results
 
     # -------- Enhanced Fetch logic with progressive fallback --------
@@ -464,28 +654,7 @@ class EnhancedSimpleScraper:
             text = self._extract_with_trafilatura(html, url)
 
         # Extract metadata from HTML
-        soup = BeautifulSoup(html, "html.parser")
-        title = soup.title.string.strip() if soup.title and soup.title.string else None
-        
-        meta_desc = None
-        og_title = og_desc = canonical = None
-        for m in soup.find_all("meta"):
-            if m.get("name", "").lower() == "description" and m.get("content"):
-                meta_desc = m["content"].strip()
-            if m.get("property") == "og:title" and m.get("content"):
-                og_title = m["content"].strip()
-            if m.get("property") == "og:description" and m.get("content"):
-                og_desc = m["content"].strip()
-                
-        link_canon = soup.find("link", rel=lambda v: v and "canonical" in v.lower())
-        if link_canon and link_canon.get("href"):
-            canonical = urljoin(url, link_canon["href"].strip())
-
-        meta = {
-            "og:title": og_title or "",
-            "og:description": og_desc or "",
-            "canonical": canonical or "",
-        }
+        title, meta_desc, meta = parse_html_meta(html, url)
         
         # Enhanced content cleaning
         text = self._clean_content_enhanced(text)
@@ -570,9 +739,8 @@ class EnhancedSimpleScraper:
             except Exception as e:
                 logger.debug(f"Trafilatura extraction failed: {e}")
         
-        # Fallback to BeautifulSoup
-        soup = BeautifulSoup(html, "html.parser")
-        return soup.get_text(separator=" ", strip=True)
+        # Fallback to plain HTML text (selectolax when installed, else BeautifulSoup)
+        return html_to_text(html)
 
     def _clean_content_enhanced(self, content: str) -> str:
         """Enhanced content cleaning for modern web frameworks"""
@@ -580,8 +748,8 @@ class EnhancedSimpleScraper:
             return ""
         
         # Remove excessive whitespace
-        content = re.sub(r'\n\s*\n', '\n\n', content)
-        content = re.sub(r'[ \t]+', ' ', content)
+        content = _BLANK_LINES_RE.sub('\n\n', content)
+        content = _INLINE_SPACE_RE.sub(' ', content)
         
         # Remove common boilerplate text patterns
         lines = content.split('\n')
@@ -594,27 +762,19 @@ class EnhancedSimpleScraper:
             if len(line) < 5:
                 continue
                 
+            lower = line.lower()
+
             # Skip common UI/navigation text (enhanced patterns)
-            skip_patterns = [
-                'home', 'about', 'contact', 'privacy', 'terms', 'policy',
-                'cookie', 'subscribe', 'newsletter', 'follow us', 'social',
-                'copyright', '©', 'all rights reserved', 'skip to',
-                'menu', 'search', 'login', 'sign up', 'cart', 'checkout',
-                'loading', 'please wait', 'javascript', 'enable', 'browser',
-                'back to top', 'scroll', 'click here', 'read more',
-                'share', 'tweet', 'facebook', 'instagram', 'linkedin'
-            ]
-            
-            if len(line) < 50 and any(pattern in line.lower() for pattern in skip_patterns):
+            if len(line) < 50 and _SKIP_LINE_RE.search(lower):
                 continue
             
             # Skip lines that are mostly symbols, numbers, or very repetitive
-            alpha_ratio = len(re.sub(r'[^a-zA-Z]', '', line)) / len(line)
+            alpha_ratio = len(_NON_ALPHA_RE.sub('', line)) / len(line)
             if alpha_ratio < 0.5 and len(line) < 100:
                 continue
             
             # Skip very repetitive lines (like navigation items)
-            words = line.lower().split()
+            words = lower.split()
             if len(words) > 1:
                 unique_words = set(words)
                 if len(unique_words) / len(words) < 0.5 and len(line) < 100:
@@ -624,7 +784,7 @@ class EnhancedSimpleScraper:
         
         # Join and final cleanup
         content = '\n'.join(cleaned_lines)
-        content = re.sub(r'\n{3,}', '\n\n', content)  # Max 2 consecutive newlines
+        content = _EXTRA_NEWLINES_RE.sub('\n\n', content)  # Max 2 consecutive newlines
         
         # Limit content length to prevent huge pages
         if len(content) > 20000:
@@ -636,31 +796,48 @@ class EnhancedSimpleScraper:
         if httpx is None:
             return None
         headers = {"User-Agent": random_user_agent(), "Accept": "*/*"}
-        async with httpx.AsyncClient(follow_redirects=True, timeout=30) as client:
-            r = await client.get(url, headers=headers)
+        async with self._http_client().stream("GET", url, headers=headers) as r:
             status = r.status_code
             final_url = str(r.url)
-            # PDF handling
-            if is_probably_pdf(final_url, r.headers):
-                text = ""
-                if pdf_extract_text:
-                    try:
-                        text = pdf_extract_text(io.BytesIO(r.content))  # type: ignore
-                    except Exception:
-                        text = ""
-                html = ""
-                return ScrapedPage(url=url, final_url=final_url, status=status, html=html,
-                                   text=text, title="PDF Document", meta_desc=None, 
-                                   meta={}, framework="pdf")
-            else:
-                html = r.text
-                text = self._extract_with_trafilatura(html, final_url)
-                soup = BeautifulSoup(html, "html.parser")
-                title = soup.title.string.strip() if soup.title and soup.title.string else None
-                return ScrapedPage(url=url, final_url=final_url, status=status, html=html,
-                                   text=text, title=title, meta_desc=None, 
-                                   meta={}, framework="static")
-        return None
+            if is_bot_blocked(status, r.headers):
+                logger.info(f"🚫 Bot protection response ({status}, server={r.headers.get('server', '')}) for {url}")
+                return None
+
+            is_pdf = is_probably_pdf(final_url, r.headers)
+            content_type = r.headers.get("content-type", "").lower()
+
+            # Don't download bodies we can't extract text from (images, archives, video...)
+            if not is_pdf and content_type and not any(t in content_type for t in TEXT_CONTENT_TYPES):
+                logger.info(f"⏭️ Skipping non-text response ({content_type}) for {url}")
+                return None
+
+            body = bytearray()
+            async for chunk in r.aiter_bytes(65536):
+                body.extend(chunk)
+                if not is_pdf and len(body) > MAX_STATIC_BYTES:
+                    logger.warning(f"✂️ Truncating oversized response ({MAX_STATIC_BYTES} bytes) for {url}")
+                    break
+            encoding = r.encoding or "utf-8"
+
+        # PDF handling
+        if is_pdf:
+            text = ""
+            if pdf_extract_text:
+                try:
+                    text = pdf_extract_text(io.BytesIO(bytes(body)))  # type: ignore
+                except Exception:
+                    text = ""
+            html = ""
+            return ScrapedPage(url=url, final_url=final_url, status=status, html=html,
+                               text=text, title="PDF Document", meta_desc=None, 
+                               meta={}, framework="pdf")
+        else:
+            html = body.decode(encoding, errors="replace")
+            text = self._extract_with_trafilatura(html, final_url)
+            title, _, _ = parse_html_meta(html, final_url)
+            return ScrapedPage(url=url, final_url=final_url, status=status, html=html,
+                               text=text, title=title, meta_desc=None, 
+                               meta={}, framework="static")
 
     # -------- Helpers --------
     def _backoff(self, attempt: int) -> float:
@@ -730,7 +907,10 @@ async def main():
         },
     ]
 
-    results = await scraper.scrape_multi_tenant(jobs)
+    try:
+        results = await scraper.scrape_multi_tenant(jobs)
+    finally:
+        await scraper.close()
     for tenant, pages in results.items():
         logger.info(f"🎯 Tenant {tenant} scraped {len(pages)} pages")
         for p in pages: